@@ -0,0 +1,160 @@
+# Benchmark: speed and recall of the face detectors, run like DroneControl.recognize on a downscaled frame.
+# With --labels, a JSON file {"image path": [[top, right, bottom, left], ...]} is the labeled frame set (paths
+# relative to the file). Without it, every known_faces image is labeled with dlib HOG at 2x upsampling and placed
+# on a frame of the drone's size at several face sizes, to see how far away each detector still finds a face.
+# Those labels come from HOG itself, so that recall only counts the faces HOG finds and favors hog: compare
+# detectors on a hand labeled set.
+# Run from the project root: python benchmarks/bench_detectors.py [--labels labels.json] [--output results.json]
+
+import os, sys
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from face_detectors import DETECTORS, create_detector
+from face_tracker import iou
+
+DIMENSIONS = (960, 720)
+CAPTURE_DIVIDER = 0.5
+# Size of the placed image relative to the frame height, 1/8 is a face about 90 pixels high
+DISTANCES = [1.0, 0.5, 0.25, 0.125]
+MIN_IOU = 0.3
+
+
+def labeled_set_from_file(path):
+    with open(path) as f:
+        labels = json.load(f)
+    folder = os.path.dirname(os.path.abspath(path))
+
+    samples = []
+    for image_path, boxes in sorted(labels.items()):
+        frame = cv2.imread(os.path.join(folder, image_path))
+        if frame is not None:
+            samples.append(('labeled', frame, [tuple(box) for box in boxes]))
+    return samples
+
+
+def labeled_set_from_known_faces():
+    """ (distance, frame, boxes) for every known face at every distance """
+    reference = create_detector('hog', upsample=2)
+    width, height = DIMENSIONS
+    faces_folder = os.path.join(ROOT, "known_faces")
+
+    samples = []
+    for name in sorted(os.listdir(faces_folder)):
+        image = cv2.imread(os.path.join(faces_folder, name))
+        if image is None:
+            continue
+        boxes = reference.detect(image)
+        if not boxes:
+            continue
+
+        for distance in DISTANCES:
+            scale = min(width / float(image.shape[1]), height / float(image.shape[0])) * distance
+            placed = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            frame = np.full((height, width, 3), 128, np.uint8)
+            top, left = (height - placed.shape[0]) // 2, (width - placed.shape[1]) // 2
+            frame[top:top + placed.shape[0], left:left + placed.shape[1]] = placed
+            frame_boxes = [(int(t * scale) + top, int(r * scale) + left, int(b * scale) + top, int(l * scale) + left)
+                           for t, r, b, l in boxes]
+            samples.append((distance, frame, frame_boxes))
+    return samples
+
+
+def count_matches(boxes, detections, min_iou=MIN_IOU):
+    """ Labeled boxes found, each detection counts for one box at most """
+    used = set()
+    found = 0
+    for box in boxes:
+        best, best_iou = None, min_iou
+        for i, detection in enumerate(detections):
+            overlap = iou(box, detection)
+            if i not in used and overlap >= best_iou:
+                best, best_iou = i, overlap
+        if best is not None:
+            used.add(best)
+            found += 1
+    return found, len(detections) - len(used)
+
+
+def detect(detector, frame):
+    """ Like DroneControl.recognize: detect on the downscaled frame and scale the boxes back """
+    small = cv2.resize(frame, (0, 0), fx=CAPTURE_DIVIDER, fy=CAPTURE_DIVIDER)
+    return [tuple(int(v / CAPTURE_DIVIDER) for v in box) for box in detector.detect(small)]
+
+
+def run_detector(detector, samples, iterations):
+    times = []
+    groups = {}
+    false_positives = 0
+    for _ in range(iterations):
+        for group, frame, boxes in samples:
+            start = time.perf_counter()
+            detections = detect(detector, frame)
+            times.append(time.perf_counter() - start)
+
+            found, extra = count_matches(boxes, detections)
+            total_found, total = groups.get(group, (0, 0))
+            groups[group] = (total_found + found, total + len(boxes))
+            false_positives += extra
+
+    times = np.array(times) * 1000
+    found = sum(f for f, _ in groups.values())
+    total = sum(t for _, t in groups.values())
+    return {
+        'p50_ms': round(float(np.percentile(times, 50)), 3),
+        'p95_ms': round(float(np.percentile(times, 95)), 3),
+        'fps': round(float(1000.0 / times.mean()), 2),
+        'recall': round(found / float(total), 4) if total else None,
+        'recall_by_group': dict((str(group), round(f / float(t), 4) if t else None)
+                                for group, (f, t) in sorted(groups.items(), reverse=True)),
+        'false_positives_per_frame': round(false_positives / float(len(times)), 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Speed and recall of the face detectors')
+    parser.add_argument('--labels', help='JSON file with the labeled frames')
+    parser.add_argument('--detectors', default=','.join(sorted(DETECTORS)), help='comma separated names')
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.labels:
+        samples = labeled_set_from_file(args.labels)
+    else:
+        print("Warning: no --labels, the known faces are labeled by HOG itself. Recall is relative to HOG, it "
+              "misses the faces HOG does not find and favors hog. Use --labels to compare detectors")
+        samples = labeled_set_from_known_faces()
+    print("{} frames, {} faces".format(len(samples), sum(len(boxes) for _, _, boxes in samples)))
+
+    results = {}
+    for name in args.detectors.split(','):
+        try:
+            detector = create_detector(name)
+        except (IOError, ValueError, AttributeError) as e:
+            print("{:<6} skipped: {}".format(name, e))
+            continue
+        results[name] = run_detector(detector, samples, args.iterations)
+
+    groups = sorted(set(g for result in results.values() for g in result['recall_by_group']), key=float, reverse=True) \
+        if not args.labels else ['labeled']
+    header = "{:<6} {:>9} {:>9} {:>8} {:>8}".format("", "p50 [ms]", "fps", "recall", "fp/frame")
+    print(header + "".join(" {:>9}".format("@" + g) for g in groups))
+    for name, result in results.items():
+        line = "{:<6} {:>9.2f} {:>9.1f} {:>8.3f} {:>8.3f}".format(
+            name, result['p50_ms'], result['fps'], result['recall'] or 0, result['false_positives_per_frame'])
+        print(line + "".join(" {:>9.3f}".format(result['recall_by_group'].get(g) or 0) for g in groups))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'frames': len(samples), 'labels': args.labels or 'hog_upsample2', 'detectors': results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
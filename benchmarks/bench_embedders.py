@@ -0,0 +1,144 @@
+# Benchmark: encode latency of the face embedders and their accuracy against dlib on the known_faces set.
+# Every known face is enrolled from its image and probed with altered copies: smaller (further away), darker and
+# mirrored. A probe is a true accept when its nearest gallery face is its own image within the embedder's
+# tolerance. With the probe's own image left out of the gallery, any match is a false accept (this assumes one
+# image per person). agreement is the share of probes that get the same answer as with dlib.
+# Run from the project root: python benchmarks/bench_embedders.py [--embedders dlib,sface] [--output results.json]
+
+import os, sys
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+import face_recognition
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from face_embedders import EMBEDDERS, create_embedder
+from face_gallery import FaceGallery
+
+
+def scaled(image, location, factor):
+    return (cv2.resize(image, (0, 0), fx=factor, fy=factor, interpolation=cv2.INTER_AREA),
+            tuple(int(v * factor) for v in location))
+
+
+def darker(image, location):
+    return cv2.convertScaleAbs(image, alpha=0.6, beta=10), location
+
+
+def mirrored(image, location):
+    top, right, bottom, left = location
+    width = image.shape[1]
+    return np.ascontiguousarray(image[:, ::-1]), (top, width - left, bottom, width - right)
+
+
+PROBES = {
+    'far': lambda image, location: scaled(image, location, 0.35),
+    'dark': darker,
+    'mirrored': mirrored
+}
+
+
+def load_faces():
+    """ (name, BGR image, face location) of every known face image with a face """
+    faces_folder = os.path.join(ROOT, "known_faces")
+    faces = []
+    for name in sorted(os.listdir(faces_folder)):
+        image = cv2.imread(os.path.join(faces_folder, name))
+        if image is None:
+            continue
+        locations = face_recognition.face_locations(image)
+        if locations:
+            faces.append((os.path.splitext(name)[0], image, locations[0]))
+    return faces
+
+
+def encode_timed(embedder, image, location, times):
+    start = time.perf_counter()
+    encodings = embedder.encode(image, [location])
+    times.append(time.perf_counter() - start)
+    return encodings[0] if encodings else None
+
+
+def evaluate(embedder, faces):
+    times = []
+    gallery_encodings = [encode_timed(embedder, image, location, times) for _, image, location in faces]
+    # Faces the embedder can not encode are not enrolled
+    faces = [face for face, encoding in zip(faces, gallery_encodings) if encoding is not None]
+    gallery_encodings = [encoding for encoding in gallery_encodings if encoding is not None]
+    names = [name for name, _, _ in faces]
+
+    decisions = {}
+    true_accepts = false_accepts = probes = 0
+    for i, (name, image, location) in enumerate(faces):
+        others = FaceGallery(embedder.tolerance, embedder.size)
+        others.extend([e for j, e in enumerate(gallery_encodings) if j != i],
+                      [n for j, n in enumerate(names) if j != i])
+        everyone = FaceGallery(embedder.tolerance, embedder.size)
+        everyone.extend(gallery_encodings, names)
+
+        for probe, alter in sorted(PROBES.items()):
+            encoding = encode_timed(embedder, *alter(image, location), times=times)
+            probes += 1
+            if encoding is None:
+                decisions[(name, probe)] = None
+                continue
+
+            match, _ = everyone.match([encoding])[0]
+            decisions[(name, probe)] = match
+            true_accepts += match == name
+            false_accepts += others.match([encoding])[0][0] is not None
+
+    times = np.array(times) * 1000
+    return {
+        'version': embedder.version,
+        'p50_ms_per_face': round(float(np.percentile(times, 50)), 3),
+        'faces_per_second': round(float(1000.0 / times.mean()), 2),
+        'true_accept_rate': round(true_accepts / float(probes), 4),
+        'false_accept_rate': round(false_accepts / float(probes), 4)
+    }, decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Speed and accuracy of the face embedders')
+    parser.add_argument('--embedders', default=','.join(sorted(EMBEDDERS)), help='comma separated names')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    faces = load_faces()
+    print("{} faces, {} probes each".format(len(faces), len(PROBES)))
+
+    results = {}
+    reference = None
+    names = args.embedders.split(',')
+    # dlib first, the others are compared to it
+    for name in sorted(names, key=lambda n: n != 'dlib'):
+        try:
+            embedder = create_embedder(name)
+        except (IOError, ValueError) as e:
+            print("{:<9} skipped: {}".format(name, e))
+            continue
+
+        result, decisions = evaluate(embedder, faces)
+        if name == 'dlib':
+            reference = decisions
+        if reference is not None:
+            same = sum(decisions[key] == reference[key] for key in reference)
+            result['agreement_with_dlib'] = round(same / float(len(reference)), 4)
+        results[name] = result
+
+    print("{:<9} {:>12} {:>10} {:>8} {:>8} {:>10}".format("", "ms per face", "faces/s", "TAR", "FAR", "agreement"))
+    for name, result in results.items():
+        print("{:<9} {:>12.2f} {:>10.1f} {:>8.3f} {:>8.3f} {:>10}".format(
+            name, result['p50_ms_per_face'], result['faces_per_second'], result['true_accept_rate'],
+            result['false_accept_rate'], result.get('agreement_with_dlib', '-')))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'faces': len(faces), 'probes': sorted(PROBES), 'embedders': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
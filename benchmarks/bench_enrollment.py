@@ -0,0 +1,43 @@
+# Benchmark: cold start enrollment of the known_faces folder with 1..N worker processes.
+# The folder is repeated to get a larger gallery, e.g. python benchmarks/bench_enrollment.py 20
+
+import os, sys
+import time
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from enrollment import encode_face_files
+
+FACES_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "known_faces")
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    paths = sorted(os.path.join(FACES_FOLDER, f) for f in os.listdir(FACES_FOLDER)) * repeat
+
+    cores = multiprocessing.cpu_count()
+    process_counts = sorted(set([1, 2, 4, 8, cores]))
+
+    print("{} images, {} cores".format(len(paths), cores))
+    print("{:>10} {:>10} {:>12} {:>8}".format("processes", "time [s]", "images/s", "speedup"))
+
+    baseline = None
+    for processes in process_counts:
+        if processes > cores:
+            continue
+
+        start = time.time()
+        results = encode_face_files(paths, processes)
+        elapsed = time.time() - start
+
+        if baseline is None:
+            baseline = elapsed
+            failures = [r for r in results if r.error]
+            for r in failures[:len(failures) // repeat]:
+                print("  failed: {} ({})".format(os.path.basename(r.path), r.error))
+
+        print("{:>10} {:>10.2f} {:>12.1f} {:>7.1f}x".format(processes, elapsed, len(paths) / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
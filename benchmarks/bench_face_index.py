@@ -0,0 +1,115 @@
+# Benchmark: recall and latency of FaceGallery.match with the approximate index (face_index.IVFIndex) against the
+# exact scan, for every storage and several nprobe values.
+# The gallery holds random unit length encodings, like dlib's. Probes are gallery faces seen again (the encoding plus
+# noise at the distance of a typical same person match) and strangers that are not in the gallery.
+# recall is the share of the seen again probes whose nearest face the index finds, agreement the share of all probes
+# that get the same answer from match as with the exact scan (name or unknown).
+# Run from the project root: python benchmarks/bench_face_index.py [--sizes 10000,100000] [--output results.json]
+
+import os, sys
+import argparse
+import json
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_gallery import FaceGallery
+from face_index import IVFIndex, STORAGES
+
+NPROBES = [4, 8, 16]
+SAME_PERSON_DISTANCE = 0.35
+PROBES = 500
+
+
+def random_encodings(rng, count, size=128):
+    # dlib encodings are roughly unit length
+    encodings = rng.normal(size=(count, size)).astype(np.float32)
+    return encodings / np.linalg.norm(encodings, axis=1)[:, None]
+
+
+def make_probes(rng, encodings, count):
+    """ Half seen again with noise, half strangers """
+    seen = encodings[rng.choice(len(encodings), count // 2, replace=False)]
+    noise = random_encodings(rng, len(seen), encodings.shape[1]) * SAME_PERSON_DISTANCE
+    strangers = random_encodings(rng, count - len(seen), encodings.shape[1])
+    return np.concatenate([seen + noise, strangers])
+
+
+def timed_matches(gallery, probes):
+    """ match of every probe on its own, like one face per frame. Returns the matches and the times in ms """
+    matches, times = [], []
+    for probe in probes:
+        start = time.perf_counter()
+        matches.append(gallery.match([probe])[0])
+        times.append((time.perf_counter() - start) * 1000)
+    return matches, np.array(times)
+
+
+def run(size, rng):
+    encodings = random_encodings(rng, size)
+    names = [str(i) for i in range(size)]
+    probes = make_probes(rng, encodings, PROBES)
+
+    gallery = FaceGallery(capacity=size)
+    gallery.extend(encodings, names)
+    exact, exact_times = timed_matches(gallery, probes)
+
+    results = {'exact': {'p50_ms': round(float(np.percentile(exact_times, 50)), 4),
+                         'p95_ms': round(float(np.percentile(exact_times, 95)), 4),
+                         'bytes_per_face': encodings.shape[1] * 4}}
+
+    for storage in STORAGES:
+        start = time.perf_counter()
+        index = IVFIndex(storage=storage).train(encodings)
+        index.add(encodings, np.arange(size))
+        build_seconds = time.perf_counter() - start
+
+        for nprobe in NPROBES:
+            index.nprobe = nprobe
+            gallery.use_index(index)
+            matches, times = timed_matches(gallery, probes)
+            gallery.use_index(None)
+
+            # The distance of the best candidate is exact, it is the nearest face if it has the smallest distance
+            seen = PROBES // 2
+            found = sum(match[1] is not None and abs(match[1] - ex[1]) < 1e-4
+                        for match, ex in zip(matches[:seen], exact[:seen]))
+
+            results['{}_nprobe{}'.format(storage, nprobe)] = {
+                'p50_ms': round(float(np.percentile(times, 50)), 4),
+                'p95_ms': round(float(np.percentile(times, 95)), 4),
+                'recall': round(found / float(seen), 4),
+                'agreement': round(sum(m[0] == e[0] for m, e in zip(matches, exact)) / float(len(probes)), 4),
+                'bytes_per_face': index.code_bytes,
+                'build_seconds': round(build_seconds, 2)
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and latency of the approximate face index')
+    parser.add_argument('--sizes', default='10000,100000', help='comma separated gallery sizes')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    results = {}
+    for size in [int(s) for s in args.sizes.split(',')]:
+        results[size] = run(size, rng)
+
+        print("\n{} faces, {} probes".format(size, PROBES))
+        print("{:<18} {:>9} {:>9} {:>8} {:>10} {:>7}".format("", "p50 [ms]", "p95 [ms]", "recall", "agreement",
+                                                           "bytes"))
+        for name, result in results[size].items():
+            print("{:<18} {:>9.3f} {:>9.3f} {:>8} {:>10} {:>7}".format(
+                name, result['p50_ms'], result['p95_ms'], result.get('recall', '-'), result.get('agreement', '-'),
+                result['bytes_per_face']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'probes': PROBES, 'same_person_distance': SAME_PERSON_DISTANCE, 'sizes': results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
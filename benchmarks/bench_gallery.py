@@ -0,0 +1,67 @@
+# Micro-benchmark: FaceGallery.match against the per-face compare_faces + face_distance loop
+# that DroneControl.identify_faces used before.
+# Run from the project root: python benchmarks/bench_gallery.py
+
+import os, sys
+import timeit
+import numpy as np
+import face_recognition
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_gallery import FaceGallery
+
+GALLERY_SIZES = [15, 100, 1000, 5000, 20000]
+FACES_PER_FRAME = 3
+REPEAT = 5
+
+
+def identify_faces_legacy(known_face_encodings, known_face_names, face_encodings):
+    """ The old identify_faces loop """
+    face_names = []
+    for face_encoding in face_encodings:
+        matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
+        name = None
+
+        face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
+        best_match_index = np.argmin(face_distances)
+        if matches[best_match_index]:
+            name = known_face_names[best_match_index]
+
+        face_names.append(name)
+    return face_names
+
+
+def random_encodings(rng, count):
+    # dlib encodings are roughly unit length
+    encodings = rng.normal(size=(count, 128))
+    return encodings / np.linalg.norm(encodings, axis=1)[:, None]
+
+
+def main():
+    rng = np.random.RandomState(0)
+    print("{:>8} {:>14} {:>14} {:>8}".format("gallery", "legacy [ms]", "gallery [ms]", "speedup"))
+
+    for size in GALLERY_SIZES:
+        # The old code kept a Python list of float64 arrays
+        known_face_encodings = list(random_encodings(rng, size))
+        known_face_names = [str(i) for i in range(size)]
+        faces = [known_face_encodings[i] + rng.normal(scale=0.01, size=128) for i in range(FACES_PER_FRAME)]
+
+        gallery = FaceGallery()
+        gallery.extend(known_face_encodings, known_face_names)
+
+        # Both implementations must agree
+        legacy_names = identify_faces_legacy(known_face_encodings, known_face_names, faces)
+        assert legacy_names == [name for name, _ in gallery.match(faces)]
+
+        number = max(1, 2000 // size)
+        legacy = min(timeit.repeat(
+            lambda: identify_faces_legacy(known_face_encodings, known_face_names, faces),
+            number=number, repeat=REPEAT)) / number
+        vectorized = min(timeit.repeat(lambda: gallery.match(faces), number=number, repeat=REPEAT)) / number
+
+        print("{:>8} {:>14.3f} {:>14.3f} {:>7.1f}x".format(size, legacy * 1000, vectorized * 1000, legacy / vectorized))
+
+
+if __name__ == '__main__':
+    main()
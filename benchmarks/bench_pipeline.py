@@ -0,0 +1,205 @@
+# Benchmark: time every stage of the DroneControl.loop pipeline on a fixed corpus of frames, without a drone.
+# The corpus is video_frame.jpg and every known_faces image, each placed on a frame of the drone's size.
+# Run from the project root:
+#   python benchmarks/bench_pipeline.py [--output results.json] [--compare baseline.json]
+# With --compare, stages whose p50 got slower than the threshold are reported and the exit code is 1.
+
+import os, sys
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import time
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from telloFaceDelivery import (DroneControl, capture_divider, dimensions, face_detector, face_detector_options,
+                               face_embedder, face_embedder_options)
+from face_detectors import create_detector
+from face_embedders import create_embedder
+from face_gallery import FaceGallery
+from video_stream import DEFAULT_JPEG_QUALITY
+
+GALLERY_SIZES = [15, 1000, 10000, 100000]
+
+
+def load_corpus():
+    """ video_frame.jpg and the known faces, each fitted onto a black frame of the drone's size """
+    width, height = dimensions
+    paths = [os.path.join(ROOT, "video_frame.jpg")]
+    faces_folder = os.path.join(ROOT, "known_faces")
+    paths += [os.path.join(faces_folder, f) for f in sorted(os.listdir(faces_folder))]
+
+    frames = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        scale = min(width / float(image.shape[1]), height / float(image.shape[0]))
+        image = cv2.resize(image, (0, 0), fx=scale, fy=scale)
+        frame = np.zeros((height, width, 3), np.uint8)
+        top, left = (height - image.shape[0]) // 2, (width - image.shape[1]) // 2
+        frame[top:top + image.shape[0], left:left + image.shape[1]] = image
+        frames.append(frame)
+    return frames
+
+
+def measure(fn, inputs, iterations):
+    """Call fn on every input, iterations times
+    Returns:
+        dict: p50/p95/p99/mean in ms and calls per second, None without inputs
+    """
+    times = []
+    for _ in range(iterations):
+        for value in inputs:
+            start = time.perf_counter()
+            fn(value)
+            times.append(time.perf_counter() - start)
+    if not times:
+        return None
+
+    times = np.array(times) * 1000
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {
+        'calls': len(times),
+        'p50_ms': round(float(p50), 4),
+        'p95_ms': round(float(p95), 4),
+        'p99_ms': round(float(p99), 4),
+        'mean_ms': round(float(times.mean()), 4),
+        'fps': round(float(1000.0 / times.mean()), 2)
+    }
+
+
+def gallery_of_size(known_encodings, size, rng, embedder):
+    """ The known faces, filled up with random unit length encodings """
+    encodings = list(known_encodings[:size])
+    if size > len(encodings):
+        filler = rng.normal(size=(size - len(encodings), embedder.size))
+        encodings += list(filler / np.linalg.norm(filler, axis=1)[:, None] * 0.5)
+    gallery = FaceGallery(embedder.tolerance, embedder.size, capacity=size)
+    gallery.extend(encodings, [str(i) for i in range(size)])
+    return gallery
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(iterations):
+    frames = load_corpus()
+    rng = np.random.RandomState(0)
+    stages = {}
+
+    small_frames = [cv2.resize(frame, (0, 0), fx=capture_divider, fy=capture_divider) for frame in frames]
+    stages['resize'] = measure(lambda frame: cv2.resize(frame, (0, 0), fx=capture_divider, fy=capture_divider),
+                               frames, iterations)
+
+    # The detector DroneControl is configured with
+    detector = create_detector(face_detector, **face_detector_options)
+    stages['face_locations'] = measure(detector.detect, small_frames, iterations)
+
+    # Encoding and everything after it only on the frames with faces. Without any, those stages are null
+    detections = [(frame, small, detector.detect(small)) for frame, small in zip(frames, small_frames)]
+    detections = [d for d in detections if d[2]]
+    if not detections:
+        print("No faces found by the {} detector, the per face stages are skipped".format(face_detector))
+    embedder = create_embedder(face_embedder, **face_embedder_options)
+    stages['face_encodings'] = measure(lambda d: embedder.encode(d[1], d[2]), detections, iterations)
+    faces = sum(len(d[2]) for d in detections)
+
+    encodings = [embedder.encode(small, locations) for _, small, locations in detections]
+    known_encodings = [e for frame_encodings in encodings for e in frame_encodings if e is not None]
+
+    # DroneControl without a drone: only what identify_faces and approach_target use
+    drone = DroneControl.__new__(DroneControl)
+    for size in GALLERY_SIZES:
+        drone.gallery = gallery_of_size(known_encodings, size, rng, embedder)
+        stages['identify_faces_{}'.format(size)] = measure(
+            lambda i: list(drone.identify_faces(detections[i][2], encodings[i])), range(len(detections)), iterations)
+
+    # Drawing the overlay and the velocities for the first face of each frame, on copies like loop(). Its prints
+    # are part of the cost, but not of the output
+    targets = []
+    for frame, _, locations in detections:
+        top, right, bottom, left = [int(v / capture_divider) for v in locations[0]]
+        targets += [(frame.copy(), top, right, bottom, left) for _ in range(iterations)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        stages['approach_target'] = measure(lambda target: drone.approach_target(*target), targets, 1)
+
+    stages['jpeg_encode'] = measure(
+        lambda frame: cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, DEFAULT_JPEG_QUALITY]), frames, iterations)
+
+    return {
+        'commit': commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'frames': len(frames),
+        'frames_with_faces': len(detections),
+        'faces': faces,
+        'iterations': iterations,
+        'face_detector': face_detector,
+        'face_embedder': face_embedder,
+        'stages': stages
+    }
+
+
+def compare(results, baseline, threshold):
+    """ Print the p50 change of every stage, return the stages that got slower than threshold """
+    regressions = []
+    print("\nagainst {}:".format(baseline.get('commit') or 'baseline'))
+    for stage, result in results['stages'].items():
+        before = baseline['stages'].get(stage)
+        if result is None or before is None or before['p50_ms'] <= 0:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1
+        slower = change > threshold
+        if slower:
+            regressions.append(stage)
+        print("{:<24} {:>10.3f} -> {:>10.3f} ms {:>+7.1%}{}".format(
+            stage, before['p50_ms'], result['p50_ms'], change, "  REGRESSION" if slower else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stage timings of the face tracking pipeline')
+    parser.add_argument('--iterations', type=int, default=5, help='passes over the corpus')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1, help='p50 slowdown that counts as regression')
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+    print("{} frames, {} with faces, {} faces".format(results['frames'], results['frames_with_faces'],
+                                                      results['faces']))
+    print("{:<24} {:>10} {:>10} {:>10} {:>10}".format("stage", "p50 [ms]", "p95 [ms]", "p99 [ms]", "fps"))
+    for stage, result in results['stages'].items():
+        if result is None:
+            print("{:<24} {:>10}".format(stage, "skipped"))
+            continue
+        print("{:<24} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.1f}".format(
+            stage, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['fps']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,2 @@
 from djitellopy.tello import Tello, BackgroundFrameRead
+from djitellopy.aio import AsyncTello
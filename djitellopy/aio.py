@@ -0,0 +1,311 @@
+# coding=utf-8
+import asyncio
+import time
+from djitellopy.tello import Tello
+
+
+class CommandProtocol(asyncio.DatagramProtocol):
+    """Receives the responses on the command socket"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client.on_response(data.decode('utf-8', errors='replace'))
+
+    def error_received(self, exc):
+        print(exc)
+
+
+class StateProtocol(asyncio.DatagramProtocol):
+    """Receives the state packets Tello pushes to port 8890"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client.on_state(Tello.parse_state(data.decode('utf-8', errors='replace')))
+
+
+class VideoProtocol(asyncio.DatagramProtocol):
+    """Receives the raw H.264 video packets Tello sends to port 11111"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client.on_video_packet(data)
+
+
+class Subscription:
+    """Async iterator over values published by the client. Holds at most maxsize values, the oldest are dropped"""
+
+    def __init__(self, subscribers, maxsize=1):
+        self.subscribers = subscribers
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        subscribers.append(self)
+
+    def put(self, value):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(value)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+    def close(self):
+        if self in self.subscribers:
+            self.subscribers.remove(self)
+
+
+class AsyncTello:
+    """asyncio client for the Ryze Tello drone. Command, state and video sockets are DatagramProtocol endpoints on
+    the running event loop, so one loop can drive the drone next to an async web server without any extra threads.
+    Host and ports can be changed to talk to a local stand-in instead of a real drone.
+    """
+    RESPONSE_TIMEOUT = 0.5  # in seconds
+    TIME_BTW_COMMANDS = 0.5  # in seconds
+    RC_CONTROL_RATE = 20  # in Hz
+
+    def __init__(self, host='192.168.10.1', command_port=8889, local_command_port=8889,
+                 state_port=8890, video_port=11111, local_ip='0.0.0.0'):
+        self.address = (host, command_port)
+        self.local_command_address = (local_ip, local_command_port)
+        self.state_address = (local_ip, state_port)
+        self.video_address = (local_ip, video_port)
+
+        self.command_transport = None
+        self.state_transport = None
+        self.video_transport = None
+
+        self.command_lock = None
+        self.pending_command = None
+        self.response_future = None
+        self.last_received_command = 0
+
+        # Newest state packet as (receive time, fields)
+        self.state = None
+        self.state_subscribers = []
+        self.video_subscribers = []
+
+        self.velocities = (0, 0, 0, 0)
+        self.rc_task = None
+        self.stream_on = False
+
+        self.last_round_trip_time = None
+        self.command_timeouts = 0
+        self.stale_responses = 0
+
+    async def open(self):
+        """ Create the command and state endpoints on the running loop """
+        loop = asyncio.get_event_loop()
+        if self.command_lock is None:
+            self.command_lock = asyncio.Lock()
+
+        if self.command_transport is None:
+            self.command_transport, _ = await loop.create_datagram_endpoint(
+                lambda: CommandProtocol(self), local_addr=self.local_command_address)
+        if self.state_transport is None:
+            self.state_transport, _ = await loop.create_datagram_endpoint(
+                lambda: StateProtocol(self), local_addr=self.state_address)
+
+    async def close(self):
+        await self.stop_rc_stream()
+        for transport in (self.command_transport, self.state_transport, self.video_transport):
+            if transport is not None:
+                transport.close()
+        self.command_transport = self.state_transport = self.video_transport = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def on_response(self, response):
+        future = self.response_future
+        if future is not None and not future.done() and Tello.is_response_to(self.pending_command, response):
+            future.set_result(response)
+        else:
+            # Late answer to a command that timed out
+            self.stale_responses += 1
+
+    def on_state(self, state):
+        self.state = (time.time(), state)
+        for subscription in list(self.state_subscribers):
+            subscription.put(state)
+
+    def on_video_packet(self, packet):
+        for subscription in list(self.video_subscribers):
+            subscription.put(packet)
+
+    async def send_command(self, command, timeout=None):
+        """Send command to Tello and wait for its response without blocking the loop. Commands are sent one at a time
+        Returns:
+            str: the response, False on timeout
+        """
+        loop = asyncio.get_event_loop()
+        async with self.command_lock:
+            # Commands very consecutive makes the drone not respond to them. So wait at least self.TIME_BTW_COMMANDS seconds
+            diff = time.time() - self.last_received_command
+            if diff < self.TIME_BTW_COMMANDS:
+                await asyncio.sleep(self.TIME_BTW_COMMANDS - diff)
+
+            self.pending_command = command
+            self.response_future = loop.create_future()
+            timestamp = time.time()
+            self.command_transport.sendto(command.encode('utf-8'), self.address)
+
+            try:
+                response = await asyncio.wait_for(self.response_future, timeout or self.RESPONSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                print('Timeout exceed on command ' + command)
+                self.command_timeouts += 1
+                return False
+            finally:
+                self.response_future = None
+
+            self.last_received_command = time.time()
+            self.last_round_trip_time = self.last_received_command - timestamp
+            return response
+
+    def send_command_without_return(self, command):
+        self.command_transport.sendto(command.encode('utf-8'), self.address)
+
+    async def send_control_command(self, command, timeout=None):
+        """
+        Returns:
+            bool: True for successful, False for unsuccessful
+        """
+        response = await self.send_command(command, timeout)
+        if response == 'OK' or response == 'ok':
+            return True
+        return Tello.return_error_on_send_command(command, response)
+
+    async def send_read_command(self, command):
+        """
+        Returns:
+            False: Unsuccessful
+            int or str: the value
+        """
+        response = await self.send_command(command)
+        if response is False or 'error' in response.lower():
+            return Tello.return_error_on_send_command(command, response)
+        response = response.strip()
+        return int(response) if response.isdigit() else response
+
+    async def connect(self):
+        """Open the sockets and enter SDK mode
+        Returns:
+            bool: True for successful, False for unsuccessful
+        """
+        await self.open()
+        return await self.send_control_command('command')
+
+    async def takeoff(self):
+        # Tello only answers once it hovers
+        return await self.send_control_command('takeoff', timeout=20)
+
+    async def land(self):
+        return await self.send_control_command('land', timeout=20)
+
+    async def emergency(self):
+        return await self.send_control_command('emergency')
+
+    async def set_speed(self, x):
+        return await self.send_control_command('speed ' + str(x))
+
+    async def streamon(self):
+        """Set video stream on and start receiving the H.264 packets"""
+        if self.video_transport is None:
+            loop = asyncio.get_event_loop()
+            self.video_transport, _ = await loop.create_datagram_endpoint(
+                lambda: VideoProtocol(self), local_addr=self.video_address)
+
+        result = await self.send_control_command('streamon')
+        if result is True:
+            self.stream_on = True
+        return result
+
+    async def streamoff(self):
+        result = await self.send_control_command('streamoff')
+        if result is True:
+            self.stream_on = False
+        return result
+
+    async def get_speed(self):
+        return await self.send_read_command('speed?')
+
+    async def get_wifi(self):
+        return await self.send_read_command('wifi?')
+
+    def get_state(self):
+        """ Newest state packet, False if none was received yet """
+        state = self.state
+        return dict(state[1]) if state is not None else False
+
+    def get_state_age(self):
+        state = self.state
+        return time.time() - state[0] if state is not None else None
+
+    def get_state_field(self, key):
+        state = self.state
+        if state is None or key not in state[1]:
+            return False
+        return state[1][key]
+
+    def get_battery(self):
+        return self.get_state_field('bat')
+
+    def get_height(self):
+        return self.get_state_field('h')
+
+    def get_distance_tof(self):
+        return self.get_state_field('tof')
+
+    def telemetry(self, maxsize=1):
+        """Async iterator over the state packets. A slow reader only gets the newest maxsize packets
+        Usage: async for state in tello.telemetry(): ...
+        """
+        return Subscription(self.state_subscribers, maxsize)
+
+    def video_packets(self, maxsize=256):
+        """ Async iterator over the raw H.264 packets of the video stream """
+        return Subscription(self.video_subscribers, maxsize)
+
+    def set_rc(self, left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity):
+        """ Velocities the RC stream sends next """
+        self.velocities = (left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity)
+
+    def start_rc_stream(self, rate=None):
+        """ Send the newest velocities at a fixed rate from a task on the loop """
+        if self.rc_task is None:
+            self.rc_task = asyncio.ensure_future(self.rc_stream(rate or self.RC_CONTROL_RATE))
+        return self.rc_task
+
+    async def stop_rc_stream(self):
+        if self.rc_task is not None:
+            self.rc_task.cancel()
+            try:
+                await self.rc_task
+            except asyncio.CancelledError:
+                pass
+            self.rc_task = None
+
+    async def rc_stream(self, rate):
+        interval = 1.0 / rate
+        next_time = time.time()
+        while True:
+            self.send_command_without_return('rc %s %s %s %s' % self.velocities)
+            next_time += interval
+            delay = next_time - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                next_time = time.time()
@@ -0,0 +1,87 @@
+# Fly AsyncTello through connect, state, takeoff, RC and land:
+#   python -m djitellopy.check_aio --simulator    against djitellopy.simulator started on this host
+#   python -m djitellopy.check_aio                against a real drone
+import argparse
+import asyncio
+import sys
+from djitellopy.aio import AsyncTello
+
+
+async def next_state(tello, timeout=2.0):
+    """ Wait for a state packet sent after this call, None on timeout """
+    telemetry = tello.telemetry()
+    try:
+        return await asyncio.wait_for(telemetry.__anext__(), timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        telemetry.close()
+
+
+async def check(tello, flight_time=1.0):
+    """ Returns the steps that failed """
+    if not await tello.connect():
+        return ['connect']
+
+    failures = []
+    state = await next_state(tello)
+    if state is None:
+        return ['state']
+    print('battery {}%, speed {}'.format(state['bat'], await tello.get_speed()))
+
+    if not await tello.takeoff():
+        return ['takeoff']
+    state = await next_state(tello)
+    print('height after takeoff {} cm'.format(state and state['h']))
+    if not state or state['h'] <= 0:
+        failures.append('takeoff height')
+
+    tello.set_rc(0, 0, 0, 50)
+    tello.start_rc_stream()
+    await asyncio.sleep(flight_time)
+    tello.set_rc(0, 0, 0, 0)
+    await tello.stop_rc_stream()
+
+    if not await tello.land():
+        return failures + ['land']
+    state = await next_state(tello)
+    print('height after landing {} cm, last round trip {:.1f} ms'.format(state and state['h'],
+                                                                           tello.last_round_trip_time * 1000))
+    if not state or state['h'] != 0:
+        failures.append('landing height')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Connect, read the state, take off and land with AsyncTello')
+    parser.add_argument('--simulator', action='store_true', help='start a local simulator and fly it')
+    parser.add_argument('--host', default='192.168.10.1', help='address of the drone')
+    args = parser.parse_args()
+
+    simulator = None
+    host = args.host
+    if args.simulator:
+        from djitellopy.simulator import TelloSimulator
+        simulator = TelloSimulator(host='127.0.0.1').start()
+        host = '127.0.0.1'
+
+    async def run():
+        # The simulator takes port 8889 on this host, then the responses come back on any free port
+        tello = AsyncTello(host, local_command_port=0 if simulator else 8889)
+        try:
+            return await check(tello)
+        finally:
+            await tello.close()
+
+    try:
+        failures = asyncio.get_event_loop().run_until_complete(run())
+    finally:
+        if simulator is not None:
+            simulator.stop()
+
+    print('FAILED: ' + ', '.join(failures) if failures else 'OK')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+# coding=utf-8
+import argparse
+import math
+import socket
+import threading
+import time
+from fractions import Fraction
+from threading import Thread
+import cv2
+import numpy as np
+from djitellopy.tello import Tello
+
+# The video stream is encoded with PyAV. Without it, the simulator runs without video
+try:
+    import av
+except ImportError:
+    av = None
+
+
+class KinematicModel:
+    """
+    Very simple flight model of the Tello: rc velocities are followed with a first order lag, move commands jump to
+    their target. Positions are in cm, x forward, y left, z up, yaw in degrees clockwise, all relative to the take
+    off point.
+    """
+    MAX_SPEED = 100.0  # cm/s at rc 100
+    MAX_YAW_RATE = 100.0  # degrees/s at rc 100
+    MAX_TILT = 20.0  # degrees at rc 100
+    RESPONSE_TIME = 0.3  # in seconds, time constant of the velocity lag
+    TAKEOFF_HEIGHT = 80.0  # in cm
+    BATTERY_DRAIN = 0.1  # percent per second of flight
+
+    def __init__(self):
+        self.position = np.zeros(3)
+        self.velocity = np.zeros(3)  # in the world frame
+        self.yaw = 0.0
+        self.yaw_rate = 0.0
+        self.rc = (0, 0, 0, 0)
+
+        self.flying = False
+        self.flight_time = 0.0
+        self.battery = 100.0
+        self.lock = threading.Lock()
+
+    def set_rc(self, left_right, forward_backward, up_down, yaw):
+        with self.lock:
+            self.rc = tuple(max(-100, min(100, v)) for v in (left_right, forward_backward, up_down, yaw))
+
+    def takeoff(self):
+        with self.lock:
+            self.flying = True
+            self.position[2] = self.TAKEOFF_HEIGHT
+
+    def land(self):
+        with self.lock:
+            self.flying = False
+            self.rc = (0, 0, 0, 0)
+            self.velocity[:] = 0
+            self.yaw_rate = 0.0
+            self.position[2] = 0.0
+
+    def move(self, forward=0.0, left=0.0, up=0.0, clockwise=0.0):
+        """ Relative move in the body frame, like the forward/left/up/cw commands """
+        with self.lock:
+            if not self.flying:
+                return False
+            heading = math.radians(self.yaw)
+            self.position[0] += forward * math.cos(heading) + left * math.sin(heading)
+            self.position[1] += left * math.cos(heading) - forward * math.sin(heading)
+            self.position[2] = max(self.position[2] + up, 0.0)
+            self.yaw = (self.yaw + clockwise + 180.0) % 360.0 - 180.0
+            return True
+
+    def step(self, dt):
+        with self.lock:
+            if not self.flying:
+                return
+
+            left_right, forward_backward, up_down, yaw = self.rc
+            heading = math.radians(self.yaw)
+            forward = forward_backward / 100.0 * self.MAX_SPEED
+            right = left_right / 100.0 * self.MAX_SPEED
+            target = np.array([forward * math.cos(heading) - right * math.sin(heading),
+                               -forward * math.sin(heading) - right * math.cos(heading),
+                               up_down / 100.0 * self.MAX_SPEED])
+
+            # First order lag towards the commanded velocities
+            alpha = min(dt / self.RESPONSE_TIME, 1.0)
+            self.velocity += (target - self.velocity) * alpha
+            self.yaw_rate += (yaw / 100.0 * self.MAX_YAW_RATE - self.yaw_rate) * alpha
+
+            self.position += self.velocity * dt
+            self.position[2] = max(self.position[2], 0.0)
+            self.yaw = (self.yaw + self.yaw_rate * dt + 180.0) % 360.0 - 180.0
+
+            self.flight_time += dt
+            self.battery = max(self.battery - self.BATTERY_DRAIN * dt, 0.0)
+
+    def state(self):
+        """ State packet in the format of the Tello SDK """
+        with self.lock:
+            left_right, forward_backward, _, _ = self.rc if self.flying else (0, 0, 0, 0)
+            height = int(self.position[2])
+            return ('pitch:%d;roll:%d;yaw:%d;vgx:%d;vgy:%d;vgz:%d;templ:%d;temph:%d;tof:%d;h:%d;bat:%d;baro:%.2f;'
+                    'time:%d;agx:%.2f;agy:%.2f;agz:%.2f;\r\n') % (
+                -forward_backward / 100.0 * self.MAX_TILT, left_right / 100.0 * self.MAX_TILT, self.yaw,
+                self.velocity[0] / 10, self.velocity[1] / 10, self.velocity[2] / 10, 60, 63,
+                height + 10 if self.flying else 10, height, self.battery, self.position[2] / 100.0,
+                self.flight_time, 0.0, 0.0, -1000.0)
+
+
+class TelloSimulator:
+    """
+    Local stand-in for the Tello drone, to run the whole pipeline without hardware. Commands are answered on
+    command_port, state packets are sent to state_port and the video file (or image) is streamed as H.264 to
+    video_port of the host that sent the last command, like the drone does. The video follows the kinematic model:
+    yawing pans it, climbing tilts it and flying forward zooms in.
+    Run it with python -m djitellopy.simulator video.mp4, then Tello(host='127.0.0.1', local_command_port=0) talks
+    to it from the same host.
+    """
+    STATE_RATE = 10  # in Hz
+    PHYSICS_RATE = 50  # in Hz
+    TELLO_PACKET_SIZE = 1460
+    PIXELS_PER_DEGREE = 12.0  # horizontal pan of the video per degree of yaw
+    PIXELS_PER_CM = 4.0  # vertical pan of the video per cm of height
+
+    def __init__(self, video_path=None, host='0.0.0.0', command_port=8889, state_port=8890, video_port=11111,
+                 fps=30, frame_size=(960, 720)):
+        self.video_path = video_path
+        self.command_address = (host, command_port)
+        self.state_port = state_port
+        self.video_port = video_port
+        self.fps = fps
+        self.frame_size = frame_size
+
+        self.model = KinematicModel()
+        self.client_ip = None
+        self.sdk_mode = False
+        self.stream_on = False
+        self.speed = 10
+        self.stopped = False
+
+        self.commands_received = 0
+        self.rc_commands = 0
+        self.state_packets_sent = 0
+        self.frames_sent = 0
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def start(self):
+        self.socket.bind(self.command_address)
+        self.socket.settimeout(1.0)
+
+        for target in (self.run_command_server, self.run_physics, self.run_video):
+            thread = Thread(target=target, args=())
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def run_command_server(self):
+        while not self.stopped:
+            try:
+                data, address = self.socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except Exception as e:
+                print(e)
+                break
+
+            self.client_ip = address[0]
+            self.commands_received += 1
+            response = self.handle_command(data.decode('utf-8', errors='replace').strip())
+            if response is not None:
+                self.socket.sendto(response.encode('utf-8'), address)
+
+    def handle_command(self, command):
+        """Apply a command to the model
+        Returns:
+            str: the response, None for commands Tello does not answer
+        """
+        parts = command.split()
+        if not parts:
+            return 'error'
+        name, args = parts[0], parts[1:]
+
+        if name == 'command':
+            self.sdk_mode = True
+            return 'ok'
+        if not self.sdk_mode:
+            return None
+
+        try:
+            if name == 'rc':
+                self.rc_commands += 1
+                self.model.set_rc(*[int(v) for v in args])
+                return None
+            if name == 'takeoff':
+                self.model.takeoff()
+                return 'ok'
+            if name in ('land', 'emergency'):
+                self.model.land()
+                return 'ok'
+            if name == 'streamon':
+                self.stream_on = True
+                return 'ok'
+            if name == 'streamoff':
+                self.stream_on = False
+                return 'ok'
+            if name == 'speed':
+                self.speed = int(args[0])
+                return 'ok'
+            if name == 'port':
+                self.state_port, self.video_port = int(args[0]), int(args[1])
+                return 'ok'
+
+            moves = {'forward': (1, 0, 0, 0), 'back': (-1, 0, 0, 0), 'left': (0, 1, 0, 0), 'right': (0, -1, 0, 0),
+                     'up': (0, 0, 1, 0), 'down': (0, 0, -1, 0), 'cw': (0, 0, 0, 1), 'ccw': (0, 0, 0, -1)}
+            if name in moves:
+                distance = float(args[0])
+                return 'ok' if self.model.move(*[v * distance for v in moves[name]]) else 'error'
+
+            state = Tello.parse_state(self.model.state())
+            reads = {'speed?': self.speed, 'battery?': state['bat'], 'time?': '%ds' % state['time'],
+                     'height?': '%ddm' % (state['h'] // 10), 'temp?': '%d~%dC' % (state['templ'], state['temph']),
+                     'attitude?': 'pitch:%d;roll:%d;yaw:%d;' % (state['pitch'], state['roll'], state['yaw']),
+                     'baro?': state['baro'], 'tof?': '%dmm' % (state['tof'] * 10), 'wifi?': 90,
+                     'acceleration?': 'agx:%.2f;agy:%.2f;agz:%.2f;' % (state['agx'], state['agy'], state['agz'])}
+            if name in reads:
+                return str(reads[name])
+        except (ValueError, IndexError, TypeError):
+            return 'error'
+
+        return 'unknown command: ' + name
+
+    def run_physics(self):
+        interval = 1.0 / self.PHYSICS_RATE
+        steps_per_state = max(int(self.PHYSICS_RATE / self.STATE_RATE), 1)
+        step = 0
+        next_time = time.time()
+        while not self.stopped:
+            self.model.step(interval)
+
+            step += 1
+            if self.sdk_mode and self.client_ip is not None and step % steps_per_state == 0:
+                self.socket.sendto(self.model.state().encode('utf-8'), (self.client_ip, self.state_port))
+                self.state_packets_sent += 1
+
+            next_time += interval
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.time()
+
+    def read_frames(self):
+        """ Frames of the video file over and over again, or the same image if it is one """
+        width, height = self.frame_size
+        image = cv2.imread(self.video_path) if self.video_path else None
+        if image is not None or not self.video_path:
+            if image is None:
+                image = np.zeros((height, width, 3), np.uint8)
+            image = cv2.resize(image, (width, height))
+            while True:
+                yield image
+
+        cap = cv2.VideoCapture(self.video_path)
+        while cap.isOpened():
+            grabbed, frame = cap.read()
+            if not grabbed:
+                # Rewind at the end of the file
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                grabbed, frame = cap.read()
+                if not grabbed:
+                    break
+            yield cv2.resize(frame, (width, height))
+        print('Could not read video ' + self.video_path)
+
+    def view(self, frame):
+        """ Move the video with the drone: pan with yaw and height, zoom with the forward position """
+        with self.model.lock:
+            if not self.model.flying:
+                return frame
+            yaw = self.model.yaw
+            forward, _, height = self.model.position
+
+        width, frame_height = self.frame_size
+        zoom = min(max(1.0 + forward / 300.0, 0.5), 4.0)
+        matrix = cv2.getRotationMatrix2D((width / 2.0, frame_height / 2.0), 0, zoom)
+        matrix[0, 2] -= yaw * self.PIXELS_PER_DEGREE
+        matrix[1, 2] += (height - KinematicModel.TAKEOFF_HEIGHT) * self.PIXELS_PER_CM
+        return cv2.warpAffine(frame, matrix, (width, frame_height))
+
+    def run_video(self):
+        if av is None:
+            print('PyAV is not installed, the simulator sends no video')
+            return
+
+        width, height = self.frame_size
+        codec = av.CodecContext.create('libx264', 'w')
+        codec.width, codec.height, codec.pix_fmt = width, height, 'yuv420p'
+        codec.framerate = Fraction(self.fps)
+        codec.time_base = Fraction(1, self.fps)
+        # A key frame every second, so the receiver can start decoding at any time
+        codec.gop_size = self.fps
+        codec.options = {'preset': 'ultrafast', 'tune': 'zerolatency'}
+
+        interval = 1.0 / self.fps
+        next_time = time.time()
+        for index, frame in enumerate(self.read_frames()):
+            if self.stopped:
+                break
+
+            if self.stream_on and self.client_ip is not None:
+                video_frame = av.VideoFrame.from_ndarray(self.view(frame), format='bgr24')
+                video_frame.pts = index
+                for packet in codec.encode(video_frame.reformat(format='yuv420p')):
+                    self.send_access_unit(bytes(packet))
+                    self.frames_sent += 1
+
+            next_time += interval
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.time()
+
+    def send_access_unit(self, data):
+        """ Split a frame into packets like Tello: all but the last one are TELLO_PACKET_SIZE bytes long """
+        address = (self.client_ip, self.video_port)
+        for start in range(0, len(data), self.TELLO_PACKET_SIZE):
+            self.socket.sendto(data[start:start + self.TELLO_PACKET_SIZE], address)
+        if len(data) % self.TELLO_PACKET_SIZE == 0:
+            # A shorter packet has to end the frame
+            self.socket.sendto(b'', address)
+
+    def stop(self):
+        self.stopped = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Tello simulator')
+    parser.add_argument('video', nargs='?', help='video file or image to stream, black frames if missing')
+    parser.add_argument('--host', default='0.0.0.0', help='address to answer commands on')
+    parser.add_argument('--command-port', type=int, default=8889)
+    parser.add_argument('--state-port', type=int, default=8890)
+    parser.add_argument('--video-port', type=int, default=11111)
+    parser.add_argument('--fps', type=int, default=30)
+    args = parser.parse_args()
+
+    simulator = TelloSimulator(args.video, args.host, args.command_port, args.state_port, args.video_port,
+                               args.fps).start()
+    print('Tello simulator listening on {}:{}'.format(args.host, args.command_port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
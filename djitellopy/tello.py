@@ -2,10 +2,20 @@
 import socket
 import time
 import threading
+import collections
+import heapq
+import itertools
 import cv2
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from threading import Thread
 from djitellopy.decorators import accepts
 
+# PyAV decodes the raw H.264 stream with less delay than cv2.VideoCapture. Without it, VideoCapture is used
+try:
+    import av
+except ImportError:
+    av = None
+
 
 class Tello:
     """Python wrapper to interact with the Ryze Tello drone using the official Tello api.
@@ -16,46 +26,166 @@ class Tello:
     UDP_IP = '192.168.10.1'
     UDP_PORT = 8889
     RESPONSE_TIMEOUT = 0.5  # in seconds
+    COMMAND_TIMEOUT = 10  # in seconds, waiting in the command queue included
     TIME_BTW_COMMANDS = 0.5  # in seconds
     TIME_BTW_RC_CONTROL_COMMANDS = 0.5  # in seconds
-    last_received_command = time.time()
+    RC_CONTROL_RATE = 20  # in Hz, for the RC sender thread
+    RC_KEEPALIVE_INTERVAL = 1.0  # in seconds, longest gap between RC commands when zero packets are skipped
+
+    # State stream, server socket
+    STATE_UDP_IP = '0.0.0.0'
+    STATE_UDP_PORT = 8890
 
     # Video stream, server socket
     VS_UDP_IP = '0.0.0.0'
     VS_UDP_PORT = 11111
+    USE_H264_DECODER = True  # decode the UDP packets with PyAV if it is installed
 
-    # VideoCapture object
-    cap = None
-    background_frame_read = None
-
-    stream_on = False
-
-    def __init__(self):
+    def __init__(self, host=None, command_port=None, local_command_port=None, state_port=None, video_port=None):
+        """Every address defaults to the class constants. Point host and ports to a local stand-in like
+        djitellopy.simulator instead of a real drone. As the simulator takes port 8889 on the same host, pass
+        local_command_port=0 to receive the responses on any free port. Nothing is shared between instances, so
+        several drones can be flown from one host as long as each gets its own local ports (see set_network_ports).
+        """
         # To send comments
-        self.address = (self.UDP_IP, self.UDP_PORT)
+        self.address = (host or self.UDP_IP, command_port or self.UDP_PORT)
         self.clientSocket = socket.socket(socket.AF_INET,  # Internet
                                           socket.SOCK_DGRAM)  # UDP
-        self.clientSocket.bind(('', self.UDP_PORT))  # For UDP response (receiving data)
-        self.response = None
+        if local_command_port is None:
+            local_command_port = self.UDP_PORT
+        self.clientSocket.bind(('', local_command_port))  # For UDP response (receiving data)
         self.stream_on = False
+        self.last_received_command = 0  # no wait before the first command
+
+        # VideoCapture object
+        self.cap = None
+        self.background_frame_read = None
+
+        # Responses are handed from the receiver thread to the waiting command. Only one command is in flight
+        self.responses = collections.deque()
+        self.response_condition = threading.Condition()
+
+        # Round trip time of the last command (in seconds), commands without response and discarded responses
+        self.last_round_trip_time = None
+        self.command_timeouts = 0
+        self.stale_responses = 0
+
+        # Newest state packet as (receive time, fields), None until the first one arrives
+        self.state = None
+        self.stateSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.state_address = (self.STATE_UDP_IP, state_port or self.STATE_UDP_PORT)
+        self.stateSocket.bind(self.state_address)
+
+        # Video stream, server socket
+        self.video_address = (self.VS_UDP_IP, video_port or self.VS_UDP_PORT)
 
         # Run tello udp receiver on background
         thread = threading.Thread(target=self.run_udp_receiver, args=())
         thread.daemon = True
         thread.start()
 
+        # Run tello state receiver on background
+        thread = threading.Thread(target=self.run_state_receiver, args=())
+        thread.daemon = True
+        thread.start()
+
+        # All commands that expect a response go through the scheduler thread
+        self.command_scheduler = CommandScheduler(self).start()
+
+        # Sends RC commands at a fixed rate once started
+        self.rc_sender = None
+
+        # Optional FlightRecorder that gets every command and state packet
+        self.recorder = None
+
+        # Optional histogram that observes the time of every command from submit until its response (s)
+        self.command_timer = None
+
     def run_udp_receiver(self):
         """Setup drone UDP receiver. This method listens for responses of Tello. Must be run from a background thread
         in order to not block the main thread."""
         while True:
             try:
-                self.response, _ = self.clientSocket.recvfrom(1024)  # buffer size is 1024 bytes
+                data, _ = self.clientSocket.recvfrom(1024)  # buffer size is 1024 bytes
+            except Exception as e:
+                print(e)
+                break
+
+            with self.response_condition:
+                self.responses.append(data.decode('utf-8', errors='replace'))
+                self.response_condition.notify()
+
+    def run_state_receiver(self):
+        """Setup drone state receiver. Tello pushes its state as a packet like 'pitch:0;roll:0;...;bat:87;...' to
+        port 8890 several times per second once it is in SDK mode. Must be run from a background thread."""
+        while True:
+            try:
+                data, _ = self.stateSocket.recvfrom(1024)
             except Exception as e:
                 print(e)
                 break
 
+            # Replacing the reference is atomic, readers always see a complete packet
+            self.state = (time.time(), self.parse_state(data.decode('utf-8', errors='replace')))
+            if self.recorder is not None:
+                self.recorder.record_telemetry(self.state[1], self.state[0])
+
+    @staticmethod
+    def parse_state(data):
+        """Parse a state packet into a dict. Numbers are converted to int or float
+        Returns:
+            dict: e.g. {'pitch': 0, 'roll': 0, 'yaw': 0, 'h': 0, 'bat': 87, 'baro': -8.49, ...}
+        """
+        state = {}
+        for field in data.strip().split(';'):
+            if ':' not in field:
+                continue
+            key, value = field.split(':', 1)
+            try:
+                value = int(value)
+            except ValueError:
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+            state[key] = value
+        return state
+
+    def get_state(self):
+        """Get the newest state packet
+        Returns:
+            False: No state received yet
+            dict: all fields of the packet
+        """
+        state = self.state
+        if state is None:
+            return False
+        return dict(state[1])
+
+    def get_state_age(self):
+        """Get the age of the newest state packet (s)
+        Returns:
+            None: No state received yet
+            float: seconds since it was received
+        """
+        state = self.state
+        if state is None:
+            return None
+        return time.time() - state[0]
+
+    def get_state_field(self, key):
+        """Get a single field of the newest state packet, without a round trip to the drone
+        Returns:
+            False: No state received yet
+            int, float or str: value of the field
+        """
+        state = self.state
+        if state is None or key not in state[1]:
+            return False
+        return state[1][key]
+
     def get_udp_video_address(self):
-        return 'udp://@' + self.VS_UDP_IP + ':' + str(self.VS_UDP_PORT)  # + '?overrun_nonfatal=1&fifo_size=5000'
+        return 'udp://@' + self.video_address[0] + ':' + str(self.video_address[1])  # + '?overrun_nonfatal=1&fifo_size=5000'
 
     def get_video_capture(self):
         """Get the VideoCapture object from the camera drone
@@ -78,7 +208,10 @@ class Tello:
             BackgroundFrameRead
         """
         if self.background_frame_read is None:
-            self.background_frame_read = BackgroundFrameRead(self, self.get_udp_video_address()).start()
+            if self.USE_H264_DECODER and av is not None:
+                self.background_frame_read = BackgroundFrameRead(self, self.video_address, decode_h264=True).start()
+            else:
+                self.background_frame_read = BackgroundFrameRead(self, self.get_udp_video_address()).start()
         return self.background_frame_read
 
     def stop_video_capture(self):
@@ -86,34 +219,88 @@ class Tello:
 
     @accepts(command=str)
     def send_command_with_return(self, command):
-        """Send command to Tello and wait for its response.
+        """Send command to Tello and wait for its response. The command is queued on the command scheduler, so this
+        blocks until the commands before it are done.
+        Return:
+            bool: True for successful, False for unsuccessful
+        """
+        try:
+            return self.command_scheduler.submit(command).result(self.COMMAND_TIMEOUT)
+        except FutureTimeoutError:
+            print('Command ' + command + ' not done within ' + str(self.COMMAND_TIMEOUT) + ' seconds')
+            return False
+
+    @accepts(command=str)
+    def send_command_async(self, command):
+        """Queue command on the command scheduler without waiting for it.
+        Return:
+            Future: resolves to the response, or False if unsuccessful
+        """
+        return self.command_scheduler.submit(command)
+
+    def execute_command(self, command):
+        """Send command to Tello and wait for its response. Only the command scheduler thread calls this. The response
+        is handed over by the receiver thread, so waiting does not use the CPU.
         Return:
             bool: True for successful, False for unsuccessful
         """
         # Commands very consecutive makes the drone not respond to them. So wait at least self.TIME_BTW_COMMANDS seconds
-        diff = time.time() * 1000 - self.last_received_command
+        diff = time.time() - self.last_received_command
         if diff < self.TIME_BTW_COMMANDS:
-            time.sleep(diff)
+            time.sleep(self.TIME_BTW_COMMANDS - diff)
+
+        # Whatever arrived in the meantime answers earlier commands that timed out
+        with self.response_condition:
+            self.stale_responses += len(self.responses)
+            self.responses.clear()
 
         print('Send command: ' + command)
-        timestamp = int(time.time() * 1000)
+        timestamp = time.time()
 
         self.clientSocket.sendto(command.encode('utf-8'), self.address)
 
-        while self.response is None:
-            if (time.time() * 1000) - timestamp > self.RESPONSE_TIMEOUT * 1000:
-                print('Timeout exceed on command ' + command)
-                return False
+        response = self.wait_for_response(command, timestamp + self.RESPONSE_TIMEOUT)
+        if self.recorder is not None:
+            self.recorder.record_command(command, response, timestamp)
+        if response is None:
+            print('Timeout exceed on command ' + command)
+            self.command_timeouts += 1
+            return False
 
-        print('Response: ' + str(self.response))
+        self.last_received_command = time.time()
+        self.last_round_trip_time = self.last_received_command - timestamp
 
-        response = self.response.decode('utf-8')
+        print('Response: ' + response)
 
-        self.response = None
+        return response
 
-        self.last_received_command = time.time() * 1000
+    def wait_for_response(self, command, deadline):
+        """Wait for the response to command until deadline (time.time() based)
+        Returns:
+            str: the response, None on timeout
+        """
+        with self.response_condition:
+            while True:
+                while self.responses:
+                    response = self.responses.popleft()
+                    if self.is_response_to(command, response):
+                        return response
+                    self.stale_responses += 1
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.response_condition.wait(remaining)
 
-        return response
+    @staticmethod
+    def is_response_to(command, response):
+        """Tello responses carry no id, but a late 'ok' can not answer a read command and a value can not answer a
+        control command. Errors can answer both.
+        """
+        response = response.strip().lower()
+        if 'error' in response or 'unknown' in response:
+            return True
+        return (response == 'ok') != command.endswith('?')
 
     @accepts(command=str)
     def send_command_without_return(self, command):
@@ -141,6 +328,8 @@ class Tello:
 
         # print('Send command (no expect response): ' + command)
         self.clientSocket.sendto(command.encode('utf-8'), self.address)
+        if self.recorder is not None:
+            self.recorder.record_command(command)
 
     @accepts(command=str)
     def send_control_command(self, command):
@@ -171,8 +360,17 @@ class Tello:
             bool: True for successful, False for unsuccessful
         """
 
-        response = self.send_command_with_return(command)
+        return self.parse_control_response(command, self.send_command_with_return(command))
+
+    @accepts(command=str)
+    def send_control_command_async(self, command):
+        """Queue a control command without waiting for it, e.g. from a request handler.
+        Return:
+            Future: resolves to True for successful, False for unsuccessful
+        """
+        return chain_future(self.send_command_async(command), lambda r: self.parse_control_response(command, r))
 
+    def parse_control_response(self, command, response):
         if response == 'OK' or response == 'ok':
             return True
         else:
@@ -260,6 +458,14 @@ class Tello:
             self.stream_on = False
         return result
 
+    def set_network_ports(self, state_port, video_port):
+        """Tell the drone where to send its state and video (SDK 2.0, Tello EDU). Needed when several drones send
+        to the same host, then the local sockets of this object must use the same ports.
+        Returns:
+            bool: True for successful, False for unsuccessful
+        """
+        return self.send_control_command("port {} {}".format(state_port, video_port))
+
     def emergency(self):
         """Stop all motors immediately
         Returns:
@@ -463,7 +669,8 @@ class Tello:
 
     @accepts(left_right_velocity=int, forward_backward_velocity=int, up_down_velocity=int, yaw_velocity=int)
     def send_rc_control(self, left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity):
-        """Send RC control via four channels. Command is sent every self.TIME_BTW_RC_CONTROL_COMMANDS seconds.
+        """Send RC control via four channels. If the RC sender is running, this only updates the velocities it sends
+        next. Otherwise the command is sent at most every self.TIME_BTW_RC_CONTROL_COMMANDS seconds.
         Arguments:
             left_right_velocity: -100~100 (left/right)
             forward_backward_velocity: -100~100 (forward/backward)
@@ -472,13 +679,35 @@ class Tello:
         Returns:
             bool: True for successful, False for unsuccessful
         """
-        if int(time.time() * 1000) - self.last_rc_control_sent < self.TIME_BTW_RC_CONTROL_COMMANDS:
+        if self.rc_sender is not None:
+            self.rc_sender.set(left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity)
+            return True
+
+        if time.time() - self.last_rc_control_sent < self.TIME_BTW_RC_CONTROL_COMMANDS:
             pass
         else:
-            self.last_rc_control_sent = int(time.time() * 1000)
+            self.last_rc_control_sent = time.time()
             return self.send_command_without_return('rc %s %s %s %s' % (left_right_velocity, forward_backward_velocity,
                                                                         up_down_velocity, yaw_velocity))
 
+    def start_rc_sender(self, rate=None, skip_zero=False):
+        """Send the newest RC velocities at a fixed rate from a background thread, independent of how often
+        send_rc_control is called. Control latency is then at most 1/rate seconds.
+        Arguments:
+            rate: RC commands per second, self.RC_CONTROL_RATE by default
+            skip_zero: do not repeat all-zero commands, except every self.RC_KEEPALIVE_INTERVAL seconds
+        Returns:
+            RcSender
+        """
+        if self.rc_sender is None:
+            self.rc_sender = RcSender(self, rate or self.RC_CONTROL_RATE, skip_zero, self.RC_KEEPALIVE_INTERVAL).start()
+        return self.rc_sender
+
+    def stop_rc_sender(self):
+        if self.rc_sender is not None:
+            self.rc_sender.stop()
+            self.rc_sender = None
+
     def set_wifi_with_ssid_password(self):
         """Set Wi-Fi with SSID password.
         Returns:
@@ -495,60 +724,88 @@ class Tello:
         return self.send_read_command('speed?')
 
     def get_battery(self):
-        """Get current battery percentage
+        """Get current battery percentage, from the state stream
         Returns:
             False: Unsuccessful
-            int: -100
+            int: 0-100
         """
-        return self.send_read_command('battery?')
+        return self.get_state_field('bat')
 
     def get_flight_time(self):
-        """Get current fly time (s)
+        """Get current fly time (s), from the state stream
         Returns:
             False: Unsuccessful
             int: Seconds elapsed during flight.
         """
-        return self.send_read_command('time?')
+        return self.get_state_field('time')
 
     def get_height(self):
-        """Get height (cm)
+        """Get height (cm), from the state stream
         Returns:
             False: Unsuccessful
             int: 0-3000
         """
-        return self.send_read_command('height?')
+        return self.get_state_field('h')
 
     def get_temperature(self):
-        """Get temperature (°C)
+        """Get temperature (°C), the mean of the lowest and highest temperature from the state stream
         Returns:
             False: Unsuccessful
-            int: 0-90
+            float: 0-90
         """
-        return self.send_read_command('temperature?')
+        state = self.get_state()
+        if not state or 'templ' not in state or 'temph' not in state:
+            return False
+        return (state['templ'] + state['temph']) / 2.0
 
     def get_attitude(self):
-        """Get IMU attitude data
+        """Get IMU attitude data (°), from the state stream
         Returns:
             False: Unsuccessful
-            int: pitch roll yaw
+            dict: pitch roll yaw
         """
-        return self.send_read_command('attitude?')
+        state = self.get_state()
+        if not state or 'pitch' not in state:
+            return False
+        return {'pitch': state['pitch'], 'roll': state['roll'], 'yaw': state['yaw']}
+
+    def get_velocity(self):
+        """Get speed along the x, y and z axis (dm/s), from the state stream
+        Returns:
+            False: Unsuccessful
+            dict: vgx vgy vgz
+        """
+        state = self.get_state()
+        if not state or 'vgx' not in state:
+            return False
+        return {'vgx': state['vgx'], 'vgy': state['vgy'], 'vgz': state['vgz']}
+
+    def get_acceleration(self):
+        """Get acceleration along the x, y and z axis (0.001g), from the state stream
+        Returns:
+            False: Unsuccessful
+            dict: agx agy agz
+        """
+        state = self.get_state()
+        if not state or 'agx' not in state:
+            return False
+        return {'agx': state['agx'], 'agy': state['agy'], 'agz': state['agz']}
 
     def get_barometer(self):
-        """Get barometer value (m)
+        """Get barometer value (m), from the state stream
         Returns:
             False: Unsuccessful
-            int: 0-100
+            float: 0-100
         """
-        return self.send_read_command('baro?')
+        return self.get_state_field('baro')
 
     def get_distance_tof(self):
-        """Get distance value from TOF (cm)
+        """Get distance value from TOF (cm), from the state stream
         Returns:
             False: Unsuccessful
             int: 30-1000
         """
-        return self.send_read_command('tof?')
+        return self.get_state_field('tof')
 
     def get_wifi(self):
         """Get Wi-Fi SNR
@@ -562,30 +819,259 @@ class Tello:
         """Call this method when you want to end the tello object"""
         if self.stream_on:
             self.streamoff()
+        self.stop_rc_sender()
+        self.command_scheduler.stop()
         if self.background_frame_read is not None:
             self.background_frame_read.stop()
         if self.cap is not None:
             self.cap.release()
 
 
-class BackgroundFrameRead:
+def chain_future(future, function):
+    """Future for function applied to the result of future"""
+    chained = Future()
+
+    def done(f):
+        try:
+            chained.set_result(function(f.result()))
+        except Exception as e:
+            chained.set_exception(e)
+
+    future.add_done_callback(done)
+    return chained
+
+
+class CommandScheduler:
     """
-    This class read frames from a VideoCapture in background. Then, just call backgroundFrameRead.frame to get the
-    actual one.
+    This class owns the request/response cycle on the command socket. Commands from any thread are queued by
+    priority and sent one at a time by a background thread, so every response is paired with the command that was
+    waiting for it. emergency and land go first and drop the control commands still queued, read queries that are
+    already queued are answered together. Callers get a Future back.
     """
+    PRIORITY_PREEMPT = 0
+    PRIORITY_CONTROL = 1
+    PRIORITY_READ = 2
 
-    def __init__(self, tello, address):
-        tello.cap = cv2.VideoCapture(address)
-        self.cap = tello.cap
+    PREEMPTING_COMMANDS = ('emergency', 'land')
 
-        if not self.cap.isOpened():
-            self.cap.open(address)
+    def __init__(self, tello):
+        self.tello = tello
+        self.stopped = False
+
+        self.queue = []
+        self.queued_reads = {}
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+
+    def start(self):
+        thread = Thread(target=self.run, args=())
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def priority(self, command):
+        if command in self.PREEMPTING_COMMANDS:
+            return self.PRIORITY_PREEMPT
+        if command.endswith('?'):
+            return self.PRIORITY_READ
+        return self.PRIORITY_CONTROL
+
+    def submit(self, command):
+        """Queue a command
+        Returns:
+            Future: resolves to the response, or False if unsuccessful
+        """
+        priority = self.priority(command)
+
+        with self.condition:
+            # Nothing sends the commands anymore
+            if self.stopped:
+                future = Future()
+                future.set_result(False)
+                return future
+
+            # Coalesce with the same query if it has not been sent yet
+            if priority == self.PRIORITY_READ and command in self.queued_reads:
+                return self.queued_reads[command]
+
+            if priority == self.PRIORITY_PREEMPT:
+                self.drop_control_commands(command)
+
+            future = Future()
+            heapq.heappush(self.queue, (priority, next(self.counter), command, future, time.time()))
+            if priority == self.PRIORITY_READ:
+                self.queued_reads[command] = future
+
+            self.condition.notify()
+        return future
+
+    def drop_control_commands(self, reason):
+        """ Resolve all queued control commands as unsuccessful. Call with the condition held """
+        kept = []
+        for entry in self.queue:
+            if entry[0] == self.PRIORITY_CONTROL:
+                print('Command ' + entry[2] + ' dropped for ' + reason)
+                if not entry[3].done():
+                    entry[3].set_result(False)
+            else:
+                kept.append(entry)
+        heapq.heapify(kept)
+        self.queue = kept
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    break
+
+                priority, _, command, future, submitted = heapq.heappop(self.queue)
+                if priority == self.PRIORITY_READ:
+                    self.queued_reads.pop(command, None)
+
+            if not future.set_running_or_notify_cancel():
+                continue
 
-        self.grabbed, self.frame = self.cap.read()
+            try:
+                response = self.tello.execute_command(command)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+
+            # Every command goes through here, also those of send_command_async
+            if self.tello.command_timer is not None:
+                self.tello.command_timer.observe(time.time() - submitted)
+            future.set_result(response)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            for entry in self.queue:
+                if not entry[3].done():
+                    entry[3].set_result(False)
+            self.queue = []
+            self.queued_reads = {}
+            self.condition.notify()
+
+
+class RcSender:
+    """
+    This class sends RC commands at a fixed rate in background. Only the newest velocities are sent, values set in
+    between are dropped. Optionally repeated all-zero commands are skipped, but a keepalive is still sent every
+    keepalive seconds so the drone does not land on its own.
+    """
+
+    def __init__(self, tello, rate, skip_zero=False, keepalive=1.0):
+        self.tello = tello
+        self.rate = rate
+        self.skip_zero = skip_zero
+        self.keepalive = keepalive
         self.stopped = False
 
+        self.velocities = (0, 0, 0, 0)
+        self.updates = 0
+
+        self.packets_sent = 0
+        self.packets_skipped = 0
+        self.updates_dropped = 0
+
     def start(self):
-        Thread(target=self.update_frame, args=()).start()
+        thread = Thread(target=self.run, args=())
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def set(self, left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity):
+        # Replacing the tuple is atomic, the sender always sees a complete set of velocities
+        self.velocities = (left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity)
+        self.updates += 1
+
+    def run(self):
+        interval = 1.0 / self.rate
+        sent = None
+        last_sent = 0
+        updates = 0
+        next_time = time.time()
+
+        while not self.stopped:
+            velocities = self.velocities
+            now = time.time()
+
+            self.updates_dropped += max(self.updates - updates - 1, 0)
+            updates = self.updates
+
+            redundant = self.skip_zero and velocities == (0, 0, 0, 0) and velocities == sent \
+                and now - last_sent < self.keepalive
+            if redundant:
+                self.packets_skipped += 1
+            else:
+                self.tello.send_command_without_return('rc %s %s %s %s' % velocities)
+                self.packets_sent += 1
+                sent = velocities
+                last_sent = now
+
+            # Fixed rate; if we fell behind, start over instead of sending a burst
+            next_time += interval
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.time()
+
+    def stop(self):
+        self.stopped = True
+
+
+class BackgroundFrameRead:
+    """
+    This class read frames in background. Then, just call backgroundFrameRead.frame to get the actual one, and
+    backgroundFrameRead.timestamp for the time its first packet arrived. Every frame gets the next sequence number;
+    wait_for_new_frame blocks until there is a frame that has not been processed yet.
+    With decode_h264, the UDP packets are read directly and decoded with PyAV without any buffering, which avoids
+    the lag of cv2.VideoCapture; only the newest decoded frame is kept. Otherwise frames are read from a VideoCapture.
+    """
+    UDP_PACKET_SIZE = 2048
+    TELLO_PACKET_SIZE = 1460
+    FIRST_FRAME_TIMEOUT = 10  # in seconds
+
+    def __init__(self, tello, address, decode_h264=False):
+        self.decode_h264 = decode_h264
+        self.frame = None
+        self.timestamp = None
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        self.frames_decoded = 0
+        self.decode_errors = 0
+
+        if decode_h264:
+            self.grabbed = False
+            self.cap = None
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.bind(address)
+            self.socket.settimeout(1.0)
+        else:
+            tello.cap = cv2.VideoCapture(address)
+            self.cap = tello.cap
+
+            if not self.cap.isOpened():
+                self.cap.open(address)
+
+            self.grabbed, self.frame = self.cap.read()
+            self.timestamp = time.time()
+
+    def start(self):
+        if self.decode_h264:
+            Thread(target=self.update_frame_h264, args=()).start()
+
+            # Like VideoCapture.read in the constructor, hand out a frame from the start
+            deadline = time.time() + self.FIRST_FRAME_TIMEOUT
+            while self.frame is None and not self.stopped and time.time() < deadline:
+                time.sleep(0.01)
+        else:
+            Thread(target=self.update_frame, args=()).start()
         return self
 
     def update_frame(self):
@@ -593,7 +1079,76 @@ class BackgroundFrameRead:
             if not self.grabbed or not self.cap.isOpened():
                 self.stop()
             else:
-                (self.grabbed, self.frame) = self.cap.read()
+                (self.grabbed, frame) = self.cap.read()
+                self.publish(frame, time.time())
+
+    def update_frame_h264(self):
+        codec = av.CodecContext.create('h264', 'r')
+        # Frame threading delays the output by one frame per thread
+        codec.thread_count = 1
+
+        access_unit = bytearray()
+        first_packet_time = None
+        while not self.stopped:
+            try:
+                packet, _ = self.socket.recvfrom(self.UDP_PACKET_SIZE)
+            except socket.timeout:
+                # The stream hiccuped, keep waiting for it
+                continue
+            except Exception as e:
+                print(e)
+                break
+
+            # A frame is timestamped with the arrival of its first packet
+            if first_packet_time is None:
+                first_packet_time = time.time()
+            access_unit += packet
+
+            # Tello splits every frame into packets of TELLO_PACKET_SIZE bytes, a shorter one ends the frame. Decoding
+            # right away avoids waiting for the start code of the next frame like a stream parser would
+            if len(packet) >= self.TELLO_PACKET_SIZE:
+                continue
+
+            try:
+                for decoded in codec.decode(av.Packet(bytes(access_unit))):
+                    self.publish(decoded.to_ndarray(format='bgr24'), first_packet_time)
+                    self.frames_decoded += 1
+            except Exception as e:
+                # Corrupt or missing packets, the decoder recovers with the next key frame
+                self.decode_errors += 1
+
+            access_unit = bytearray()
+            first_packet_time = None
+
+        self.socket.close()
+
+    def publish(self, frame, timestamp):
+        self.grabbed = frame is not None
+        if frame is None:
+            return
+
+        with self.condition:
+            self.frame = frame
+            self.timestamp = timestamp
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def wait_for_new_frame(self, last_sequence, timeout=None):
+        """Wait until there is a frame newer than last_sequence, without spinning.
+        Arguments:
+            last_sequence: sequence number of the last frame processed, 0 for none
+            timeout: seconds to wait at most, None to wait forever
+        Returns:
+            (int, ndarray, float): sequence, frame and timestamp of the newest frame. On timeout or when stopped the
+                sequence is still last_sequence
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != last_sequence or self.stopped, timeout)
+            if self.sequence == last_sequence:
+                return last_sequence, None, None
+            return self.sequence, self.frame, self.timestamp
 
     def stop(self):
-        self.stopped = True
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
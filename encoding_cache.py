@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+CACHE_VERSION = 1
+
+
+def file_digest(path):
+    """ SHA-1 of a file's content """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class EncodingCache(object):
+    """Persistent cache of the face encodings of an image folder.
+    The cache lives next to the folder as two files: <folder>_cache.npy holds a float32 matrix with one row per
+    image that contains a face (in sorted file name order), <folder>_cache.json is the index that maps every file
+    name to its size, mtime, SHA-1 and row. Only new or changed images get encoded again, deleted ones are dropped,
+    and an unchanged folder is served straight from a memory map of the matrix.
+    Encodings of different models can not be mixed: with a model version, the cache is named after it and only
+    accepted if it was written by the same model.
+    """
+
+    def __init__(self, directory, cache_path=None, encoding_size=128, model=None):
+        self.directory = directory
+        self.encoding_size = encoding_size
+        self.model = model
+
+        if cache_path is None:
+            cache_path = os.path.normpath(directory) + ('_' + model if model else '') + '_cache'
+        self.matrix_path = cache_path + '.npy'
+        self.index_path = cache_path + '.json'
+
+    def read(self):
+        """Read the index and memory map the matrix
+        Returns:
+            (dict, ndarray): entries by file name and the encodings. ({}, None) if there is no valid cache
+        """
+        if not os.path.exists(self.index_path):
+            return {}, None
+
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            if (index.get('version') != CACHE_VERSION or index.get('encoding_size') != self.encoding_size
+                    or index.get('model') != self.model):
+                return {}, None
+
+            rows = index['rows']
+            if rows == 0:
+                matrix = np.empty((0, self.encoding_size), dtype=np.float32)
+            else:
+                matrix = np.load(self.matrix_path, mmap_mode='r')
+
+            # A crash between writing the matrix and the index leaves them out of sync
+            if matrix.shape != (rows, self.encoding_size) or matrix.dtype != np.float32:
+                return {}, None
+
+            return index['files'], matrix
+        except (IOError, OSError, ValueError, KeyError) as e:
+            print("Encoding cache not usable: {}".format(e))
+            return {}, None
+
+    def write(self, entries, matrix):
+        """ Atomically replace the cache, the matrix first so the index never points past it """
+        tmp_matrix_path = self.matrix_path + '.tmp'
+        with open(tmp_matrix_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+        os.replace(tmp_matrix_path, self.matrix_path)
+
+        index = {
+            'version': CACHE_VERSION,
+            'encoding_size': self.encoding_size,
+            'model': self.model,
+            'rows': len(matrix),
+            'files': entries
+        }
+        tmp_index_path = self.index_path + '.tmp'
+        with open(tmp_index_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_index_path, self.index_path)
+
+    def sync(self, encode_files):
+        """Bring the cache up to date with the folder.
+        Arguments:
+            encode_files: function that takes a list of image paths and returns an encoding (or None if the image
+                contains no face) for each of them, in the same order
+        Returns:
+            (list, ndarray): file names of all images with a face and their encodings, in sorted file name order
+        """
+        entries, matrix = self.read()
+
+        new_entries = {}
+        stale_files = []
+        for file in sorted(os.listdir(self.directory)):
+            if file.startswith('.'):
+                continue
+
+            path = os.path.join(self.directory, file)
+            stat = os.stat(path)
+            entry = entries.get(file)
+
+            if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                new_entries[file] = entry
+                continue
+
+            # Touched or copied files keep their encoding as long as the content is the same
+            digest = file_digest(path)
+            if entry is not None and entry['sha1'] == digest:
+                new_entries[file] = dict(entry, size=stat.st_size, mtime=stat.st_mtime_ns)
+                continue
+
+            new_entries[file] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': digest, 'row': None}
+            stale_files.append(file)
+
+        if matrix is not None and new_entries == entries:
+            files = [file for file in sorted(new_entries) if new_entries[file]['row'] is not None]
+            return files, matrix
+
+        print("Encoding {} new or changed faces".format(len(stale_files)))
+        encodings = dict(zip(stale_files, encode_files([os.path.join(self.directory, f) for f in stale_files])))
+
+        files = []
+        rows = []
+        for file in sorted(new_entries):
+            entry = new_entries[file]
+            if file in encodings:
+                encoding = encodings[file]
+            elif entry['row'] is not None:
+                encoding = matrix[entry['row']]
+            else:
+                encoding = None
+
+            if encoding is None:
+                entry['row'] = None
+            else:
+                entry['row'] = len(rows)
+                files.append(file)
+                rows.append(np.asarray(encoding, dtype=np.float32))
+
+        new_matrix = np.array(rows, dtype=np.float32).reshape(-1, self.encoding_size)
+
+        # Drop the old memory map before its file gets replaced
+        matrix = None
+        self.write(new_entries, new_matrix)
+
+        _, matrix = self.read()
+        if matrix is None:
+            matrix = new_matrix
+        return files, matrix
@@ -0,0 +1,52 @@
+import multiprocessing
+from collections import namedtuple
+from functools import partial
+from face_embedders import FaceEmbedder, get_embedder
+
+# encoding is None if the image could not be enrolled, error then tells why
+EnrollmentResult = namedtuple('EnrollmentResult', ['path', 'encoding', 'error'])
+
+
+def encode_face_file(path, embedder='dlib', embedder_options=None):
+    """ Load an image file and encode the first face in it, with the embedder of that name or a FaceEmbedder """
+    try:
+        if not isinstance(embedder, FaceEmbedder):
+            embedder = get_embedder(embedder, **(embedder_options or {}))
+        face_encodings = embedder.encode_file(path)
+    except Exception as e:
+        return EnrollmentResult(path, None, str(e))
+
+    if len(face_encodings) == 0:
+        return EnrollmentResult(path, None, "no face found")
+    return EnrollmentResult(path, face_encodings[0], None)
+
+
+def encode_face_files(paths, processes=None, chunksize=None, embedder='dlib', embedder_options=None):
+    """Encode many image files on a process pool. Every worker process loads the embedder once.
+    Arguments:
+        paths: image files
+        processes: number of worker processes, None for one per core, 1 to encode in this process
+        chunksize: images handed to a worker at once, None to pick one from the number of images
+    Returns:
+        list: an EnrollmentResult per path, in the same order as paths
+    """
+    paths = list(paths)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(paths))
+
+    encode = partial(encode_face_file, embedder=embedder, embedder_options=embedder_options)
+    if processes <= 1:
+        return [encode(path) for path in paths]
+
+    # Few large chunks keep the IPC overhead low, but enough of them that no worker idles at the end
+    if chunksize is None:
+        chunksize = max(1, len(paths) // (processes * 4))
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        # map keeps the order of paths
+        return pool.map(encode, paths, chunksize)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,129 @@
+import os
+import threading
+import cv2
+import numpy as np
+import face_recognition
+
+# Model files of the detectors that are not part of a Python package, see README
+MODELS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+DNN_PROTOTXT = os.path.join(MODELS_FOLDER, "deploy.prototxt")
+DNN_MODEL = os.path.join(MODELS_FOLDER, "res10_300x300_ssd_iter_140000.caffemodel")
+LBP_CASCADE = os.path.join(MODELS_FOLDER, "lbpcascade_frontalface_improved.xml")
+
+
+def haar_cascade_path():
+    """ Frontal face Haar cascade that comes with opencv-python """
+    folder = getattr(getattr(cv2, 'data', None), 'haarcascades', MODELS_FOLDER)
+    return os.path.join(folder, "haarcascade_frontalface_default.xml")
+
+
+class FaceDetector(object):
+    """Finds faces in a BGR frame. detect() returns the boxes as (top, right, bottom, left) in frame coordinates,
+    like face_recognition.face_locations, so they can be passed on to face_recognition.face_encodings.
+    A detector may be shared by several recognition threads, e.g. of a fleet.
+    """
+    name = None
+
+    def detect(self, frame):
+        raise NotImplementedError
+
+
+class HogDetector(FaceDetector):
+    """ dlib's HOG detector (or its CNN with model='cnn'), upsampling the frame upsample times """
+    name = 'hog'
+
+    def __init__(self, upsample=1, model='hog'):
+        self.upsample = upsample
+        self.model = model
+
+    def detect(self, frame):
+        return face_recognition.face_locations(frame, self.upsample, self.model)
+
+
+class DnnDetector(FaceDetector):
+    """
+    OpenCV DNN with the res10 SSD face detector (Caffe). The frame is scaled to input_size, so the cost hardly
+    depends on the frame size, and faces of about 30 pixels and more are found.
+    """
+    name = 'dnn'
+
+    def __init__(self, prototxt=DNN_PROTOTXT, model=DNN_MODEL, confidence=0.5, input_size=(300, 300)):
+        for path in (prototxt, model):
+            if not os.path.exists(path):
+                raise IOError("DNN face detector model missing: {}".format(path))
+
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        # The network keeps its input and output, one frame at a time goes through it
+        self.lock = threading.Lock()
+        self.confidence = confidence
+        self.input_size = input_size
+
+    def detect(self, frame):
+        height, width = frame.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(frame, self.input_size), 1.0, self.input_size, (104.0, 177.0, 123.0))
+        with self.lock:
+            self.net.setInput(blob)
+            detections = self.net.forward()
+
+        # Rows of (image, class, confidence, left, top, right, bottom), coordinates relative to the frame
+        detections = detections.reshape(-1, 7)
+        detections = detections[detections[:, 2] >= self.confidence]
+        boxes = np.clip(detections[:, 3:7], 0.0, 1.0) * [width, height, width, height]
+
+        face_locations = []
+        for left, top, right, bottom in boxes.astype(int):
+            if right > left and bottom > top:
+                face_locations.append((int(top), int(right), int(bottom), int(left)))
+        return face_locations
+
+
+class CascadeDetector(FaceDetector):
+    """ OpenCV cascade classifier, Haar (the default) or LBP. The fastest, but misses turned and tilted faces """
+    name = 'haar'
+
+    def __init__(self, path=None, scale_factor=1.1, min_neighbors=5, min_size=(20, 20)):
+        path = path or haar_cascade_path()
+        if not os.path.exists(path):
+            raise IOError("Cascade missing: {}".format(path))
+
+        self.classifier = cv2.CascadeClassifier(path)
+        if self.classifier.empty():
+            raise IOError("Could not load cascade: {}".format(path))
+        self.lock = threading.Lock()
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+
+    def detect(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        gray = cv2.equalizeHist(gray)
+        with self.lock:
+            faces = self.classifier.detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                                     minNeighbors=self.min_neighbors, minSize=self.min_size)
+        return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in faces]
+
+
+class LbpDetector(CascadeDetector):
+    name = 'lbp'
+
+    def __init__(self, path=LBP_CASCADE, **options):
+        CascadeDetector.__init__(self, path, **options)
+
+
+DETECTORS = {
+    'hog': HogDetector,
+    'dnn': DnnDetector,
+    'haar': CascadeDetector,
+    'lbp': LbpDetector
+}
+
+
+def create_detector(name, **options):
+    """Create a detector by name: hog, dnn, haar or lbp. Options go to its constructor
+    Raises:
+        ValueError: unknown name
+        IOError: the model files are missing
+    """
+    if name not in DETECTORS:
+        raise ValueError("Unknown face detector '{}', use one of {}".format(name, ', '.join(sorted(DETECTORS))))
+    return DETECTORS[name](**options)
@@ -0,0 +1,159 @@
+import os
+import threading
+import cv2
+import numpy as np
+import face_recognition
+from face_detectors import MODELS_FOLDER
+
+# Model files of the OpenCV DNN embedders, see README
+SFACE_MODEL = os.path.join(MODELS_FOLDER, "face_recognition_sface_2021dec.onnx")
+SFACE_INT8_MODEL = os.path.join(MODELS_FOLDER, "face_recognition_sface_2021dec_int8.onnx")
+OPENFACE_MODEL = os.path.join(MODELS_FOLDER, "nn4.small2.v1.t7")
+
+
+class FaceEmbedder(object):
+    """Turns faces into encodings that are compared by euclidean distance. size is the length of an encoding,
+    tolerance the largest distance that is still the same person, and version identifies the model: encodings of
+    different versions can not be compared, so galleries and caches are kept per version.
+    """
+    name = None
+    version = None
+    options = {}
+    size = 128
+    tolerance = 0.6
+
+    def encode(self, frame, face_locations):
+        """Encodings of the faces at face_locations, (top, right, bottom, left) boxes in the BGR frame. One per
+        location, in the same order, None for a face that could not be encoded
+        """
+        raise NotImplementedError
+
+    def encode_file(self, path):
+        """ Encodings of all faces in an image file """
+        image = cv2.imread(path)
+        if image is None:
+            raise IOError("Could not read image")
+        encodings = self.encode(image, face_recognition.face_locations(image))
+        return [encoding for encoding in encodings if encoding is not None]
+
+
+class DlibEmbedder(FaceEmbedder):
+    """ dlib's ResNet, the encoder of face_recognition """
+    name = 'dlib'
+    version = 'dlib_resnet_v1'
+
+    def encode(self, frame, face_locations):
+        return face_recognition.face_encodings(frame, face_locations)
+
+    def encode_file(self, path):
+        return face_recognition.face_encodings(face_recognition.load_image_file(path))
+
+
+class DnnEmbedder(FaceEmbedder):
+    """
+    Embedding network run with OpenCV DNN on the face box, widened by margin on each side and scaled to input_size.
+    The faces are not aligned by landmarks, which costs some accuracy. Encodings are L2 normalized.
+    """
+    name = 'dnn'
+    # Oldest OpenCV whose DNN module reads the model
+    min_opencv = None
+
+    def __init__(self, model, input_size, scale=1.0, mean=(0, 0, 0), swap_rb=True, margin=0.2):
+        if not os.path.exists(model):
+            raise IOError("Face embedding model missing: {}".format(model))
+
+        try:
+            self.net = cv2.dnn.readNet(model)
+        except cv2.error as e:
+            raise IOError("OpenCV {} can not read {}{}: {}".format(
+                cv2.__version__, model, ", it needs OpenCV {} or later".format(self.min_opencv)
+                if self.min_opencv else "", e))
+        self.lock = threading.Lock()
+        self.input_size = input_size
+        self.scale = scale
+        self.mean = mean
+        self.swap_rb = swap_rb
+        self.margin = margin
+
+    def crop(self, frame, location):
+        top, right, bottom, left = location
+        height, width = frame.shape[:2]
+        pad_x, pad_y = int((right - left) * self.margin), int((bottom - top) * self.margin)
+        top, bottom = max(top - pad_y, 0), min(bottom + pad_y, height)
+        left, right = max(left - pad_x, 0), min(right + pad_x, width)
+        return frame[top:bottom, left:right]
+
+    def encode(self, frame, face_locations):
+        crops = [self.crop(frame, location) for location in face_locations]
+        # A box outside the frame leaves an empty crop, its face gets None
+        faces = [i for i, crop in enumerate(crops) if crop.size]
+        results = [None] * len(crops)
+        if not faces:
+            return results
+
+        # All faces of a frame go through the network as one batch
+        blob = cv2.dnn.blobFromImages([crops[i] for i in faces], self.scale, self.input_size, self.mean,
+                                      self.swap_rb, False)
+        with self.lock:
+            self.net.setInput(blob)
+            encodings = self.net.forward().reshape(len(faces), -1)
+        encodings /= np.maximum(np.linalg.norm(encodings, axis=1, keepdims=True), 1e-12)
+        for i, encoding in zip(faces, encodings):
+            results[i] = encoding
+        return results
+
+
+class SFaceEmbedder(DnnEmbedder):
+    """ SFace (ONNX, 128 values) of the OpenCV model zoo, optionally the int8 quantized model """
+    name = 'sface'
+    # Cosine similarity 0.363 of the model zoo, as distance between normalized encodings
+    tolerance = 1.128
+
+    def __init__(self, int8=False, model=None, **options):
+        self.version = 'sface_2021dec_int8' if int8 else 'sface_2021dec'
+        # The quantized operators of the int8 model came later
+        self.min_opencv = '4.7.0' if int8 else '4.5.4'
+        DnnEmbedder.__init__(self, model or (SFACE_INT8_MODEL if int8 else SFACE_MODEL), (112, 112), **options)
+
+
+class OpenFaceEmbedder(DnnEmbedder):
+    """ OpenFace nn4.small2 (Torch, 128 values), small and fast """
+    name = 'openface'
+    version = 'openface_nn4_small2_v1'
+    tolerance = 0.99
+
+    def __init__(self, model=OPENFACE_MODEL, **options):
+        options.setdefault('scale', 1 / 255.0)
+        DnnEmbedder.__init__(self, model, (96, 96), **options)
+
+
+EMBEDDERS = {
+    'dlib': DlibEmbedder,
+    'sface': SFaceEmbedder,
+    'openface': OpenFaceEmbedder
+}
+
+# One instance per name and options in each process, the networks are loaded once
+_embedders = {}
+
+
+def create_embedder(name, **options):
+    """Create an embedder by name: dlib, sface or openface. Options go to its constructor
+    Raises:
+        ValueError: unknown name
+        IOError: the model file is missing or this OpenCV can not read it
+    """
+    if name not in EMBEDDERS:
+        raise ValueError("Unknown face embedder '{}', use one of {}".format(name, ', '.join(sorted(EMBEDDERS))))
+    embedder = EMBEDDERS[name](**options)
+    # Lets enrollment processes create the same embedder
+    embedder.options = dict(options)
+    return embedder
+
+
+def get_embedder(name, **options):
+    """ Shared embedder of this process, created on first use """
+    key = (name, tuple(sorted(options.items())))
+    if key not in _embedders:
+        _embedders[key] = create_embedder(name, **options)
+    return _embedders[key]
@@ -0,0 +1,197 @@
+import threading
+import numpy as np
+
+# Same default tolerance as face_recognition.compare_faces
+DEFAULT_TOLERANCE = 0.6
+ENCODING_SIZE = 128
+
+
+class FaceGallery(object):
+    """Known face encodings kept in one contiguous float32 matrix.
+    All faces of a frame are scored against the whole gallery with a single matrix product, using
+    |a - b|^2 = |a|^2 + |b|^2 - 2ab. The squared norms of the gallery are cached, so the cost per frame is one
+    (faces x 128) by (128 x gallery) multiplication.
+    Very large galleries can use an approximate index (face_index.IVFIndex) instead: match() then only computes the
+    exact distances of the candidates the index finds, as soon as the gallery has index_min_size faces.
+    """
+
+    def __init__(self, tolerance=DEFAULT_TOLERANCE, encoding_size=ENCODING_SIZE, capacity=64):
+        self.tolerance = tolerance
+        self.encoding_size = encoding_size
+        self.names = []
+        self.count = 0
+
+        self._encodings = np.empty((capacity, encoding_size), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._lock = threading.Lock()
+
+        self.index = None
+        self.index_min_size = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def encodings(self):
+        """View on the enrolled encodings, shape (count, encoding_size)"""
+        return self._encodings[:self.count]
+
+    def _reserve(self, size):
+        """Grow the buffers geometrically, so appends stay amortized O(1)"""
+        capacity = self._encodings.shape[0]
+        if size <= capacity:
+            return
+
+        capacity = max(capacity, 1)
+        while capacity < size:
+            capacity *= 2
+
+        encodings = np.empty((capacity, self.encoding_size), dtype=np.float32)
+        encodings[:self.count] = self._encodings[:self.count]
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:self.count] = self._sq_norms[:self.count]
+
+        self._encodings = encodings
+        self._sq_norms = sq_norms
+
+    def append(self, encoding, name):
+        """ Enroll a single face encoding """
+        self.extend([encoding], [name])
+
+    def extend(self, encodings, names):
+        """ Enroll several face encodings at once """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.encoding_size)
+        if len(encodings) != len(names):
+            raise ValueError("Got {} encodings but {} names".format(len(encodings), len(names)))
+
+        with self._lock:
+            start = self.count
+            end = start + len(encodings)
+            self._reserve(end)
+
+            self._encodings[start:end] = encodings
+            self._sq_norms[start:end] = np.einsum('ij,ij->i', encodings, encodings)
+            self.names.extend(names)
+            if self.index is not None:
+                self.index.add(encodings, np.arange(start, end))
+
+            # Publish the new rows only after they are written
+            self.count = end
+
+    def load(self, encodings, names):
+        """Replace the gallery with the given encodings. A float32 array (e.g. a read-only memory map of the encoding
+        cache) is used as is without copying; it is only copied once the first face gets appended.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.encoding_size)
+        if len(encodings) != len(names):
+            raise ValueError("Got {} encodings but {} names".format(len(encodings), len(names)))
+
+        sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+
+        with self._lock:
+            self._encodings = encodings
+            self._sq_norms = sq_norms
+            self.names = list(names)
+            self.count = len(encodings)
+            if self.index is not None:
+                self.index.reset()
+                self.index.add(encodings, np.arange(len(encodings)))
+
+    def use_index(self, index, min_size=0):
+        """Match with an index of the gallery (its entries are the gallery rows) from min_size faces on. Later
+        appends go to the index as well. None goes back to the exact scan
+        """
+        with self._lock:
+            self.index = index
+            self.index_min_size = min_size
+
+    def clear(self):
+        with self._lock:
+            self.names = []
+            self.count = 0
+            if self.index is not None:
+                self.index.reset()
+
+    def distances(self, face_encodings):
+        """Euclidean distances between every face and every known face
+        Returns:
+            ndarray: shape (faces, gallery size)
+        """
+        faces = np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.encoding_size)
+
+        count = self.count
+        known = self._encodings[:count]
+        known_sq_norms = self._sq_norms[:count]
+
+        sq_distances = np.einsum('ij,ij->i', faces, faces)[:, None] + known_sq_norms[None, :] \
+            - 2.0 * np.dot(faces, known.T)
+        np.maximum(sq_distances, 0, out=sq_distances)
+
+        return np.sqrt(sq_distances, out=sq_distances)
+
+    def match(self, face_encodings):
+        """Best match for every face
+        Returns:
+            list: (name, distance) per face. name is None if no known face is within the tolerance
+        """
+        if len(face_encodings) == 0:
+            return []
+
+        index = self.index
+        if index is not None and self.count >= self.index_min_size:
+            return self.match_indexed(index, face_encodings)
+
+        names = self.names
+        distances = self.distances(face_encodings)
+        if distances.shape[1] == 0:
+            return [(None, None)] * len(distances)
+
+        best = np.argmin(distances, axis=1)
+        best_distances = distances[np.arange(len(best)), best]
+
+        matches = []
+        for index, distance in zip(best, best_distances):
+            distance = float(distance)
+            matches.append((names[index] if distance <= self.tolerance else None, distance))
+        return matches
+
+    def match_indexed(self, index, face_encodings):
+        """ match() with the candidates of the index, ranked by their exact distance """
+        faces = np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.encoding_size)
+        names = self.names
+
+        matches = []
+        for face in faces:
+            rows = index.search(face)
+            if len(rows) == 0:
+                matches.append((None, None))
+                continue
+
+            known = self._encodings[rows]
+            sq_distances = np.dot(face, face) + self._sq_norms[rows] - 2.0 * np.dot(known, face)
+            best = int(np.argmin(sq_distances))
+            distance = float(np.sqrt(max(sq_distances[best], 0.0)))
+            matches.append((names[rows[best]] if distance <= self.tolerance else None, distance))
+        return matches
+
+    def top_k(self, face_encodings, k):
+        """The k nearest known faces for every face, closest first. Always an exact scan
+        Returns:
+            list: a list of (name, distance) per face
+        """
+        if len(face_encodings) == 0:
+            return []
+
+        names = self.names
+        distances = self.distances(face_encodings)
+        k = min(k, distances.shape[1])
+        if k == 0:
+            return [[] for _ in range(len(distances))]
+
+        # argpartition keeps this O(gallery) instead of a full sort
+        candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        results = []
+        for row, indices in zip(distances, candidates):
+            indices = indices[np.argsort(row[indices])]
+            results.append([(names[i], float(row[i])) for i in indices])
+        return results
@@ -0,0 +1,310 @@
+import hashlib
+import json
+import math
+import os
+import numpy as np
+
+INDEX_VERSION = 2
+STORAGES = ('float32', 'float16', 'pq')
+# Options that change the trained centroids and codes, the others only change how the index is searched
+TRAINING_OPTIONS = ('dimension', 'nlist', 'storage', 'pq_subvectors', 'seed')
+
+
+def content_keys(encodings):
+    """ Digest of every encoding, so a saved entry is only reused for a row with the same encoding """
+    encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+    return np.array([hashlib.sha1(row.tobytes()).hexdigest() for row in encodings], dtype=str)
+
+
+def squared_distances(x, y, y_sq_norms=None):
+    """ Squared euclidean distances between the rows of x and y, shape (len(x), len(y)) """
+    if y_sq_norms is None:
+        y_sq_norms = np.einsum('ij,ij->i', y, y)
+    distances = np.einsum('ij,ij->i', x, x)[:, None] + y_sq_norms[None, :] - 2.0 * np.dot(x, y.T)
+    return np.maximum(distances, 0, out=distances)
+
+
+def kmeans(points, k, iterations=20, seed=0, batch=4096):
+    """Lloyd's k-means, started from k random points. Empty clusters get a random point again
+    Returns:
+        ndarray: the k centroids, float32
+    """
+    rng = np.random.RandomState(seed)
+    points = np.asarray(points, dtype=np.float32)
+    centroids = points[rng.choice(len(points), k, replace=len(points) < k)].copy()
+
+    for _ in range(iterations):
+        assignment = assign(points, centroids, batch)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, points)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = points[rng.choice(len(points), int(empty.sum()))]
+    return centroids
+
+
+def assign(points, centroids, batch=4096):
+    """ Index of the nearest centroid of every point, in batches to bound the memory """
+    sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    assignment = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), batch):
+        assignment[start:start + batch] = np.argmin(
+            squared_distances(points[start:start + batch], centroids, sq_norms), axis=1)
+    return assignment
+
+
+class InvertedList(object):
+    """ Gallery rows and codes of one cluster, in buffers that grow like the gallery's """
+
+    def __init__(self, code_shape, code_dtype, capacity=16):
+        self.count = 0
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.codes = np.empty((capacity,) + code_shape, dtype=code_dtype)
+
+    def add(self, ids, codes):
+        end = self.count + len(ids)
+        if end > len(self.ids):
+            capacity = max(len(self.ids), 1)
+            while capacity < end:
+                capacity *= 2
+            grown_ids = np.empty(capacity, dtype=self.ids.dtype)
+            grown_ids[:self.count] = self.ids[:self.count]
+            grown_codes = np.empty((capacity,) + self.codes.shape[1:], dtype=self.codes.dtype)
+            grown_codes[:self.count] = self.codes[:self.count]
+            self.ids, self.codes = grown_ids, grown_codes
+
+        self.ids[self.count:end] = ids
+        self.codes[self.count:end] = codes
+        # Publish the new entries only after they are written
+        self.count = end
+
+
+class IVFIndex(object):
+    """
+    Inverted file index of face encodings for approximate nearest neighbor search. k-means splits the encodings
+    into nlist clusters, and a query only scans the nprobe clusters with the nearest centroids. The scanned
+    encodings are stored as float32, float16 (half the memory) or product quantized ('pq': pq_subvectors bytes per
+    face, distances from per query lookup tables on the residual to the centroid). search() only returns candidates,
+    FaceGallery ranks the best rerank of them by their exact distance.
+    """
+
+    def __init__(self, dimension=128, nlist=None, nprobe=8, storage='float16', pq_subvectors=16, rerank=32, seed=0):
+        """
+        Arguments:
+            nlist: clusters, by default the square root of the number of encodings it is trained on
+            nprobe: clusters scanned per query, more is slower and finds more true nearest neighbors
+            rerank: candidates per query whose exact distance is computed
+        """
+        if storage not in STORAGES:
+            raise ValueError("Unknown index storage '{}', use one of {}".format(storage, ', '.join(STORAGES)))
+        if storage == 'pq' and dimension % pq_subvectors:
+            raise ValueError("pq_subvectors must divide the dimension {}".format(dimension))
+
+        self.dimension = dimension
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.storage = storage
+        self.pq_subvectors = pq_subvectors
+        self.rerank = rerank
+        self.seed = seed
+
+        self.centroids = None
+        self.codebooks = None
+        self.codebook_sq_norms = None
+        self.lists = []
+
+    def __len__(self):
+        return sum(inverted_list.count for inverted_list in self.lists)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    @property
+    def code_bytes(self):
+        """ Memory of the stored encodings per face """
+        if self.storage == 'pq':
+            return self.pq_subvectors
+        return self.dimension * (2 if self.storage == 'float16' else 4)
+
+    def train(self, encodings, max_points=65536):
+        """ Fit the centroids (and the PQ codebooks) to a sample of encodings, this empties the index """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dimension)
+        rng = np.random.RandomState(self.seed)
+        if len(encodings) > max_points:
+            encodings = encodings[rng.choice(len(encodings), max_points, replace=False)]
+
+        nlist = self.nlist or max(1, int(round(math.sqrt(len(encodings)))))
+        self.centroids = kmeans(encodings, min(nlist, len(encodings)), seed=self.seed)
+
+        if self.storage == 'pq':
+            residuals = encodings - self.centroids[assign(encodings, self.centroids)]
+            subvectors = residuals.reshape(len(residuals), self.pq_subvectors, -1)
+            self.codebooks = np.stack([kmeans(subvectors[:, m], min(256, len(subvectors)), iterations=10,
+                                              seed=self.seed + m) for m in range(self.pq_subvectors)])
+        self.reset()
+        return self
+
+    def reset(self):
+        """ Drop all entries, the training stays """
+        if self.codebooks is not None:
+            self.codebook_sq_norms = np.einsum('mkd,mkd->mk', self.codebooks, self.codebooks)
+        if self.storage == 'pq':
+            code_shape, code_dtype = (self.pq_subvectors,), np.uint8
+        else:
+            code_shape, code_dtype = (self.dimension,), np.dtype(self.storage)
+        self.lists = [InvertedList(code_shape, code_dtype) for _ in range(len(self.centroids))]
+
+    def encode(self, encodings, assignment):
+        if self.storage != 'pq':
+            return encodings.astype(self.storage)
+
+        residuals = (encodings - self.centroids[assignment]).reshape(len(encodings), self.pq_subvectors, -1)
+        codes = np.empty((len(encodings), self.pq_subvectors), dtype=np.uint8)
+        for m in range(self.pq_subvectors):
+            codes[:, m] = np.argmin(squared_distances(residuals[:, m], self.codebooks[m]), axis=1)
+        return codes
+
+    def add(self, encodings, ids):
+        """ Insert encodings under their gallery rows, without training again """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dimension)
+        ids = np.asarray(ids, dtype=np.int64)
+        assignment = assign(encodings, self.centroids)
+        codes = self.encode(encodings, assignment)
+
+        # Group by cluster with one sort
+        order = np.argsort(assignment, kind='stable')
+        clusters, starts = np.unique(assignment[order], return_index=True)
+        for cluster, start, end in zip(clusters, starts, list(starts[1:]) + [len(order)]):
+            members = order[start:end]
+            self.lists[cluster].add(ids[members], codes[members])
+
+    def search(self, query, candidates=None):
+        """Approximate nearest gallery rows of one encoding
+        Returns:
+            ndarray: up to candidates (by default rerank) rows, in no particular order
+        """
+        candidates = candidates or self.rerank
+        query = np.asarray(query, dtype=np.float32).reshape(1, self.dimension)
+        probes = np.argsort(squared_distances(query, self.centroids)[0])[:self.nprobe]
+
+        ids, distances = [], []
+        for cluster in probes:
+            inverted_list = self.lists[cluster]
+            count = inverted_list.count
+            if count == 0:
+                continue
+            codes = inverted_list.codes[:count]
+            ids.append(inverted_list.ids[:count])
+
+            if self.storage == 'pq':
+                # Distances of the residual to every codebook entry, then one lookup per subvector and face
+                residual = (query[0] - self.centroids[cluster]).reshape(self.pq_subvectors, -1)
+                tables = self.codebook_sq_norms - 2.0 * np.einsum('mkd,md->mk', self.codebooks, residual)
+                distances.append(tables[np.arange(self.pq_subvectors), codes].sum(axis=1)
+                                 + np.dot(residual.ravel(), residual.ravel()))
+            else:
+                distances.append(squared_distances(query, codes.astype(np.float32))[0])
+
+        if not ids:
+            return np.empty(0, dtype=np.int64)
+        ids, distances = np.concatenate(ids), np.concatenate(distances)
+        if len(ids) > candidates:
+            ids = ids[np.argpartition(distances, candidates - 1)[:candidates]]
+        return ids
+
+    def options(self):
+        return {'dimension': self.dimension, 'nlist': self.nlist, 'nprobe': self.nprobe, 'storage': self.storage,
+                'pq_subvectors': self.pq_subvectors, 'rerank': self.rerank, 'seed': self.seed}
+
+    def save(self, path, names, encodings):
+        """Atomically write the index. names and encodings are those of the gallery rows, the entries are mapped
+        to the rows of the gallery it gets loaded into by name and content key
+        """
+        ids = [inverted_list.ids[:inverted_list.count] for inverted_list in self.lists]
+        rows = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        arrays = {
+            'centroids': self.centroids,
+            'list_sizes': np.array([len(list_ids) for list_ids in ids], dtype=np.int64),
+            'names': np.array([names[i] for i in rows], dtype=str),
+            'keys': content_keys(np.asarray(encodings, dtype=np.float32).reshape(-1, self.dimension)[rows]),
+            'codes': np.concatenate([inverted_list.codes[:inverted_list.count] for inverted_list in self.lists]),
+            'meta': np.array(json.dumps(dict(self.options(), version=INDEX_VERSION)))
+        }
+        if self.codebooks is not None:
+            arrays['codebooks'] = self.codebooks
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, names, encodings):
+        """Read an index written by save, with its entries moved to the rows of the gallery with the same name and
+        encoding. Entries of a name that is gone or whose encoding has changed are dropped
+        Returns:
+            (IVFIndex, ndarray): the index and the rows of the gallery it has no entry for
+        """
+        with np.load(path) as data:
+            options = json.loads(str(data['meta']))
+            if options.pop('version') != INDEX_VERSION:
+                raise ValueError("Index version {} not supported".format(options.get('version')))
+
+            index = cls(**options)
+            index.centroids = data['centroids']
+            index.codebooks = data['codebooks'] if 'codebooks' in data.files else None
+            index.reset()
+
+            row_of = dict(((name, key), row) for row, (name, key) in enumerate(zip(names, content_keys(encodings))))
+            rows = np.array([row_of.get((name, key), -1) for name, key in zip(data['names'], data['keys'])],
+                            dtype=np.int64)
+            codes = data['codes']
+            list_sizes = data['list_sizes']
+
+        start = 0
+        for inverted_list, size in zip(index.lists, list_sizes):
+            list_rows, list_codes = rows[start:start + size], codes[start:start + size]
+            known = list_rows >= 0
+            inverted_list.add(list_rows[known], list_codes[known])
+            start += size
+
+        missing = np.ones(len(names), dtype=bool)
+        missing[rows[rows >= 0]] = False
+        return index, np.flatnonzero(missing)
+
+
+def load_or_build(path, encodings, names, **options):
+    """Index of a gallery. A saved index with the same training options is reused, only the rows it has no entry
+    for (new faces, or faces whose encoding changed) are added and the search options are applied without training
+    again. Otherwise it is trained on the encodings. It is saved again if anything changed
+    """
+    index = None
+    if os.path.exists(path):
+        try:
+            index, missing = IVFIndex.load(path, names, encodings)
+            saved = index.options()
+            if any(saved[key] != value for key, value in options.items() if key in TRAINING_OPTIONS):
+                index = None
+        except (IOError, OSError, ValueError, KeyError) as e:
+            print("Face index not usable: {}".format(e))
+            index = None
+
+    if index is None:
+        print("Training the face index on {} faces".format(len(names)))
+        index = IVFIndex(**options).train(encodings)
+        missing = np.arange(len(names))
+        changed = True
+    else:
+        changed = len(missing) > 0 or any(saved[key] != value for key, value in options.items())
+        for key, value in options.items():
+            setattr(index, key, value)
+
+    if len(missing):
+        index.add(np.asarray(encodings)[missing], missing)
+    if changed:
+        index.save(path, names, encodings)
+    return index
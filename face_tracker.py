@@ -0,0 +1,187 @@
+import itertools
+from collections import namedtuple
+import cv2
+import numpy as np
+
+# What the recognition worker needs to know about a track to reuse its encoding
+TrackSnapshot = namedtuple('TrackSnapshot', ['id', 'location', 'encoding', 'encoded_at'])
+
+
+def iou(a, b):
+    """ Intersection over union of two (top, right, bottom, left) boxes """
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+
+    intersection = max(0, right - left) * max(0, bottom - top)
+    union = (a[1] - a[3]) * (a[2] - a[0]) + (b[1] - b[3]) * (b[2] - b[0]) - intersection
+    if union <= 0:
+        return 0.0
+    return intersection / float(union)
+
+
+def match_tracks(face_locations, tracks, min_iou):
+    """Pair every face with the track it overlaps most. Each track is used at most once.
+    Returns:
+        list: the matched track (or None) for every face
+    """
+    pairs = []
+    for i, location in enumerate(face_locations):
+        for j, track in enumerate(tracks):
+            overlap = iou(location, track.location)
+            if overlap >= min_iou:
+                pairs.append((overlap, i, j))
+
+    matched = [None] * len(face_locations)
+    used = set()
+    for _, i, j in sorted(pairs, reverse=True):
+        if matched[i] is None and j not in used:
+            matched[i] = tracks[j]
+            used.add(j)
+    return matched
+
+
+class Track(object):
+    """A face followed from frame to frame between two detections"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, location, name, encoding, points, track_id=None, encoded_at=None):
+        self.id = track_id if track_id is not None else next(self._ids)
+        self.name = name
+
+        # Cached identity: the encoding and when it was computed
+        self.encoding = encoding
+        self.encoded_at = encoded_at
+
+        top, right, bottom, left = location
+        self.center = np.array([(left + right) / 2.0, (top + bottom) / 2.0])
+        self.size = np.array([float(right - left), float(bottom - top)])
+
+        self.points = points
+        self.seeded_points = len(points)
+        self.frames_tracked = 0
+
+    @property
+    def location(self):
+        """ (top, right, bottom, left) in frame coordinates """
+        left, top = self.center - self.size / 2
+        right, bottom = self.center + self.size / 2
+        return int(top), int(right), int(bottom), int(left)
+
+    @property
+    def confidence(self):
+        """ Share of the feature points seeded at the last detection that are still tracked """
+        if self.seeded_points == 0:
+            return 0.0
+        return len(self.points) / float(self.seeded_points)
+
+
+class FaceTracker(object):
+    """
+    Propagates face boxes from frame to frame with sparse Lucas-Kanade optical flow, which only takes a few
+    milliseconds per frame. Each box follows the median motion and scale change of the corner features inside it,
+    points that fail the forward-backward check are dropped. Call reset() with every detection result and update()
+    with every new frame.
+    """
+
+    def __init__(self, scale=0.5, max_points=40, max_fb_error=1.0):
+        # Tracking runs on a downscaled grayscale frame
+        self.scale = scale
+        self.max_points = max_points
+        self.max_fb_error = max_fb_error
+
+        self.tracks = []
+        self._prev_gray = None
+        self._lk_params = dict(winSize=(15, 15), maxLevel=3,
+                               criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+    def _gray(self, frame):
+        small = cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def _seed_points(self, gray, location):
+        """ Corner features inside a face box, in downscaled frame coordinates """
+        top, right, bottom, left = [int(v * self.scale) for v in location]
+        height, width = gray.shape
+        top, bottom = max(top, 0), min(bottom, height)
+        left, right = max(left, 0), min(right, width)
+
+        if bottom - top < 4 or right - left < 4:
+            return np.empty((0, 1, 2), dtype=np.float32)
+
+        mask = np.zeros_like(gray)
+        mask[top:bottom, left:right] = 255
+        points = cv2.goodFeaturesToTrack(gray, self.max_points, 0.01, 3, mask=mask)
+        if points is None:
+            return np.empty((0, 1, 2), dtype=np.float32)
+        return points.astype(np.float32)
+
+    @property
+    def confidence(self):
+        """ Confidence of the weakest track, 0 without any tracks """
+        if not self.tracks:
+            return 0.0
+        return min(track.confidence for track in self.tracks)
+
+    def reset(self, frame, face_locations, face_names, face_encodings=None, track_ids=None, encoded_at=None):
+        """ Start new tracks from the faces detected in frame. Faces with a track id continue that track """
+        gray = self._gray(frame)
+        faces = len(face_locations)
+
+        self.tracks = [Track(face_locations[i], face_names[i],
+                             face_encodings[i] if face_encodings is not None else None,
+                             self._seed_points(gray, face_locations[i]),
+                             track_ids[i] if track_ids is not None else None,
+                             encoded_at[i] if encoded_at is not None else None)
+                       for i in range(faces)]
+        self._prev_gray = gray
+        return self.tracks
+
+    def snapshot(self):
+        """ The current boxes and cached identities, safe to hand to another thread """
+        return [TrackSnapshot(track.id, track.location, track.encoding, track.encoded_at)
+                for track in self.tracks if track.encoding is not None]
+
+    def update(self, frame):
+        """ Move all tracks to a new frame """
+        gray = self._gray(frame)
+        prev_gray = self._prev_gray
+        self._prev_gray = gray
+
+        if prev_gray is None:
+            return self.tracks
+
+        for track in self.tracks:
+            if len(track.points) == 0:
+                continue
+            self._update_track(track, prev_gray, gray)
+
+        return self.tracks
+
+    def _update_track(self, track, prev_gray, gray):
+        prev_points = track.points
+        points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, prev_points, None, **self._lk_params)
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, points, None, **self._lk_params)
+
+        fb_error = np.linalg.norm((prev_points - back_points).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < self.max_fb_error)
+
+        track.points = points[good]
+        track.frames_tracked += 1
+        if good.sum() < 2:
+            return
+
+        prev_good = prev_points[good].reshape(-1, 2)
+        next_good = points[good].reshape(-1, 2)
+
+        # Translation: median motion of the points
+        shift = np.median(next_good - prev_good, axis=0)
+
+        # Scale: median change of the distance to the point cloud's center
+        prev_spread = np.linalg.norm(prev_good - prev_good.mean(axis=0), axis=1)
+        next_spread = np.linalg.norm(next_good - next_good.mean(axis=0), axis=1)
+        valid = prev_spread > 1e-3
+        scale = np.median(next_spread[valid] / prev_spread[valid]) if valid.any() else 1.0
+
+        track.center = track.center + shift / self.scale
+        track.size = track.size * scale
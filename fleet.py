@@ -0,0 +1,183 @@
+# Fly several drones from one host: python fleet.py fleet.json
+# The file lists the drones, each with its own address and the local ports its state and video are sent to:
+#   [{"name": "alpha", "host": "192.168.0.11", "state_port": 8890, "video_port": 11111},
+#    {"name": "bravo", "host": "192.168.0.12", "state_port": 8891, "video_port": 11112}]
+# Optional per drone: command_port (8889) and local_command_port (0, any free port). Every drone gets its own
+# Tello, control loop and video stream, the models, the known faces and the recognition threads are shared.
+# Routes: /fleet_status, /fleet/<name>/video_feed, /fleet/<name>/drone_status and /fleet/<name>/drone_command,
+# the single drone routes use the first drone. The metrics of each drone have a drone label with its name.
+
+import sys
+import json
+from collections import OrderedDict
+from flask import Response, jsonify, request, redirect, url_for, abort
+from djitellopy import Tello
+from face_gallery import FaceGallery
+from encoding_cache import EncodingCache
+from recognition_worker import RecognitionPool
+from video_stream import FrameBroadcaster
+from metrics import Gauge
+import telloFaceDelivery
+from telloFaceDelivery import DroneControl, app, create_models, status_of, apply_command, video_gen
+
+
+class FleetManager(object):
+    """
+    Drones flown from one host. The detector, embedder (or the recognition service running them), gallery and
+    encoding cache exist once, and a single RecognitionPool serves the frames of all drones, oldest first. A drone
+    adds its Tello (sockets, decoder and RC sender), its control loop and its video stream.
+    """
+
+    def __init__(self, drones, workers=None):
+        """
+        Arguments:
+            drones: list of dicts with name, host and optionally command_port, local_command_port, state_port
+                and video_port
+            workers: recognition threads, by default recognition_workers
+        """
+        check_ports(drones)
+
+        workers = workers or telloFaceDelivery.recognition_workers
+        self.detector, self.embedder, self.recognition_service = create_models(workers)
+        self.gallery = FaceGallery(self.embedder.tolerance, self.embedder.size)
+        self.encoding_cache = EncodingCache("known_faces", encoding_size=self.embedder.size,
+                                            model=self.embedder.version)
+        # Set by the first drone once it has loaded the known faces
+        self.faces_loaded = False
+
+        self.recognition_pool = RecognitionPool(workers)
+
+        self.drones = OrderedDict()
+        self.broadcasters = OrderedDict()
+        for config in drones:
+            self.add(config)
+
+    def add(self, config):
+        """ Connect a drone and start its loop """
+        name = config['name']
+        tello = Tello(config.get('host'), config.get('command_port'), config.get('local_command_port', 0),
+                      config.get('state_port'), config.get('video_port'))
+
+        # The drone sends to 8890 and 11111 until it is told otherwise
+        state_port, video_port = tello.state_address[1], tello.video_address[1]
+        if (state_port, video_port) != (Tello.STATE_UDP_PORT, Tello.VS_UDP_PORT):
+            if not tello.connect() or not tello.set_network_ports(state_port, video_port):
+                tello.end()
+                raise Exception("Could not set the ports of {}".format(name))
+
+        drone = DroneControl(tello, fleet=self, name=name)
+        self.drones[name] = drone
+        self.broadcasters[name] = FrameBroadcaster(drone, frame_size=telloFaceDelivery.dimensions).start()
+        print("{} connected".format(name))
+        return drone
+
+    def status(self):
+        status = dict((name, status_of(drone)) for name, drone in self.drones.items())
+        for name, drone in self.drones.items():
+            worker = drone.recognition_worker
+            status[name].update(frames_submitted=worker.frames_submitted, frames_dropped=worker.frames_dropped,
+                                frames_processed=worker.frames_processed,
+                                viewers=self.broadcasters[name].viewers)
+        return status
+
+    def shutdown(self):
+        for name, drone in self.drones.items():
+            self.broadcasters[name].stop()
+            try:
+                drone.shutdown()
+            except Exception as e:
+                print("Shutdown of {} failed: {}".format(name, e))
+        self.recognition_pool.stop()
+        if self.drones:
+            next(iter(self.drones.values())).save_face_index()
+        if self.recognition_service is not None:
+            self.recognition_service.close()
+
+
+def check_ports(drones):
+    """
+    Raises:
+        ValueError: a drone has no name, or two drones use the same name or local port
+    """
+    names, ports = set(), {}
+    for config in drones:
+        name = config.get('name')
+        if not name or name in names:
+            raise ValueError("Every drone needs its own name, got '{}'".format(name))
+        names.add(name)
+
+        used = [config.get('state_port') or Tello.STATE_UDP_PORT, config.get('video_port') or Tello.VS_UDP_PORT]
+        if config.get('local_command_port'):
+            used.append(config['local_command_port'])
+        for port in used:
+            if port in ports:
+                raise ValueError("{} and {} both use local port {}".format(ports[port], name, port))
+            ports[port] = name
+
+
+fleet = None
+
+Gauge('tello_fleet_drones', 'Drones in the fleet', lambda: len(fleet.drones))
+Gauge('tello_fleet_recognition_queue_depth', 'Frames of all drones waiting for the recognition pool',
+      lambda: fleet.recognition_pool.queue_depth)
+
+
+def fleet_drone(name):
+    if name not in fleet.drones:
+        abort(404)
+    return fleet.drones[name]
+
+
+@app.route('/fleet_status')
+def fleet_status():
+    return jsonify(fleet.status())
+
+
+@app.route('/fleet/<name>/video_feed')
+def fleet_video_feed(name):
+    """ Like /video_feed, for one drone of the fleet """
+    fleet_drone(name)
+    broadcaster = fleet.broadcasters[name]
+    profile = broadcaster.profile(request.args.get('width', type=int),
+                                  request.args.get('height', type=int),
+                                  request.args.get('quality', type=int))
+    return Response(video_gen(profile, request.args.get('fps', type=float), broadcaster),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/fleet/<name>/drone_status')
+def fleet_drone_status(name):
+    return jsonify(status_of(fleet_drone(name)))
+
+
+@app.route('/fleet/<name>/drone_command', methods=['POST'])
+def fleet_drone_command(name):
+    apply_command(fleet_drone(name), request.json)
+    return redirect(url_for('fleet_drone_status', name=name))
+
+
+def main(path):
+    global fleet
+    with open(path) as f:
+        drones = json.load(f)
+    if not drones:
+        raise ValueError("{} lists no drones".format(path))
+
+    fleet = FleetManager(drones)
+
+    # The single drone routes show the first drone
+    first = next(iter(fleet.drones))
+    telloFaceDelivery.drone = fleet.drones[first]
+    telloFaceDelivery.broadcaster = fleet.broadcasters[first]
+
+    try:
+        app.run(host='0.0.0.0', debug=False, threaded=True)
+    finally:
+        fleet.shutdown()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python fleet.py fleet.json")
+        sys.exit(1)
+    main(sys.argv[1])
@@ -0,0 +1,262 @@
+import bisect
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from collections import namedtuple
+from threading import Thread
+import cv2
+import numpy as np
+
+# A recording is a file header followed by chunks. Every chunk is written in one piece and starts with a header
+# that holds its record count, payload size and time range, so the chunks can be indexed by time by hopping from
+# header to header, without reading the records. A chunk cut short by a crash is ignored
+FILE_MAGIC = b'TFDREC\x00\x01'
+CHUNK_MAGIC = b'CHNK'
+CHUNK_HEADER = struct.Struct('<4sIIdd')  # magic, records, payload size, first and last timestamp
+RECORD_HEADER = struct.Struct('<dBI')  # timestamp, kind, data size
+FRAME_HEADER = struct.Struct('<IHHB')  # sequence, height, width, channels
+
+# Record kinds
+FRAME_JPEG = 1
+FRAME_RAW = 2
+TELEMETRY = 3
+DETECTION = 4
+COMMAND = 5
+FRAME_KINDS = (FRAME_JPEG, FRAME_RAW)
+
+Chunk = namedtuple('Chunk', ['offset', 'records', 'size', 'first_time', 'last_time'])
+Record = namedtuple('Record', ['timestamp', 'kind', 'data'])
+
+
+class FlightRecorder:
+    """
+    This class records a flight: video frames, telemetry, detections and commands, each with its timestamp. The
+    record methods only queue a reference and never block the caller; frames are encoded and written by a background
+    thread. If the writer falls behind, frames are dropped and counted instead; the small records are always kept.
+    Frames are stored as JPEG, or raw with jpeg_quality=None, which replays bit exact at the cost of disk space.
+    """
+
+    def __init__(self, path, jpeg_quality=90, chunk_size=1 << 20, chunk_interval=1.0, max_pending_frames=8):
+        self.path = path
+        self.jpeg_quality = jpeg_quality
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+
+        self.records_written = 0
+        self.frames_dropped = 0
+        self.chunks_written = 0
+        self.bytes_written = 0
+
+        self._queue = queue.Queue()
+        self._frame_slots = threading.BoundedSemaphore(max_pending_frames)
+        self._thread = None
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Never append to an older recording: a chunk cut short at its end would hide everything after it. A name
+        # that is taken gets a number
+        base, extension = os.path.splitext(self.path)
+        number = 1
+        while True:
+            try:
+                self._file = open(self.path, 'xb')
+                break
+            except FileExistsError:
+                self.path = "{}_{}{}".format(base, number, extension)
+                number += 1
+        self._file.write(FILE_MAGIC)
+
+        self._thread = Thread(target=self.run, args=())
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def record_frame(self, frame, sequence, timestamp=None):
+        """ Record a video frame. The frame must not be modified afterwards """
+        if not self._frame_slots.acquire(False):
+            self.frames_dropped += 1
+            return
+        self._queue.put((FRAME_RAW, timestamp or time.time(), (sequence, frame)))
+
+    def record_telemetry(self, state, timestamp=None):
+        self._queue.put((TELEMETRY, timestamp or time.time(), state))
+
+    def record_detection(self, sequence, face_locations, face_names, duration=None, timestamp=None):
+        detection = {
+            'sequence': sequence,
+            'face_locations': [[int(v) for v in location] for location in face_locations],
+            'face_names': list(face_names),
+            'duration': duration
+        }
+        self._queue.put((DETECTION, timestamp or time.time(), detection))
+
+    def record_command(self, command, response=None, timestamp=None):
+        self._queue.put((COMMAND, timestamp or time.time(), {'command': command, 'response': response}))
+
+    def encode(self, kind, value):
+        """ Serialize a queued record, on the writer thread """
+        if kind == FRAME_RAW:
+            sequence, frame = value
+            height, width = frame.shape[:2]
+            channels = frame.shape[2] if frame.ndim == 3 else 1
+            header = FRAME_HEADER.pack(sequence, height, width, channels)
+            if self.jpeg_quality is None:
+                return kind, header + np.ascontiguousarray(frame).tobytes()
+            _, image = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            return FRAME_JPEG, header + image.tobytes()
+        return kind, json.dumps(value).encode('utf-8')
+
+    def run(self):
+        payload = bytearray()
+        records = 0
+        first_time = last_time = None
+        chunk_deadline = None
+        done = False
+
+        while not done:
+            timeout = None if chunk_deadline is None else max(chunk_deadline - time.time(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+
+            if item is None:
+                done = True
+            elif item:
+                kind, timestamp, value = item
+                try:
+                    kind, data = self.encode(kind, value)
+                except Exception as e:
+                    print("Could not record: {}".format(e))
+                    continue
+                finally:
+                    if item[0] == FRAME_RAW:
+                        self._frame_slots.release()
+
+                payload += RECORD_HEADER.pack(timestamp, kind, len(data))
+                payload += data
+                records += 1
+                first_time = timestamp if first_time is None else min(first_time, timestamp)
+                last_time = timestamp if last_time is None else max(last_time, timestamp)
+                if chunk_deadline is None:
+                    chunk_deadline = time.time() + self.chunk_interval
+
+            # Write a chunk once it is large or old enough, so little is lost on a crash
+            if records and (done or len(payload) >= self.chunk_size or time.time() >= chunk_deadline):
+                self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, records, len(payload), first_time, last_time))
+                self._file.write(payload)
+                self._file.flush()
+
+                self.chunks_written += 1
+                self.records_written += records
+                self.bytes_written += CHUNK_HEADER.size + len(payload)
+                payload = bytearray()
+                records = 0
+                first_time = last_time = chunk_deadline = None
+
+        self._file.close()
+
+    def close(self):
+        """ Write everything queued and close the file """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+class FlightRecording:
+    """
+    Read access to a recording. The file is memory mapped, so records are slices of the map and only the parts that
+    are read get loaded. records() starts at the first chunk that can hold the start time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+        if self._map[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError("Not a flight recording: " + path)
+
+        self.chunks = []
+        offset = len(FILE_MAGIC)
+        while offset + CHUNK_HEADER.size <= size:
+            magic, records, chunk_size, first_time, last_time = CHUNK_HEADER.unpack_from(self._map, offset)
+            if magic != CHUNK_MAGIC or offset + CHUNK_HEADER.size + chunk_size > size:
+                break
+            self.chunks.append(Chunk(offset, records, chunk_size, first_time, last_time))
+            offset += CHUNK_HEADER.size + chunk_size
+
+        # Records of different threads are not strictly in time order. The running maximum of the chunks' last
+        # timestamps is, and no chunk before the first one that reaches start holds a record after it
+        self._last_times = []
+        for chunk in self.chunks:
+            self._last_times.append(max(chunk.last_time, self._last_times[-1]) if self._last_times else chunk.last_time)
+
+    @property
+    def start_time(self):
+        return min(chunk.first_time for chunk in self.chunks) if self.chunks else None
+
+    @property
+    def end_time(self):
+        return self._last_times[-1] if self.chunks else None
+
+    def __len__(self):
+        return sum(chunk.records for chunk in self.chunks)
+
+    def records(self, start=None, end=None, kinds=None):
+        """Iterate over the records in file order
+        Arguments:
+            start, end: only records in this time range
+            kinds: only records of these kinds
+        """
+        first = bisect.bisect_left(self._last_times, start) if start is not None else 0
+        view = memoryview(self._map)
+        for chunk in self.chunks[first:]:
+            if end is not None and chunk.first_time > end:
+                continue
+
+            offset = chunk.offset + CHUNK_HEADER.size
+            for _ in range(chunk.records):
+                timestamp, kind, size = RECORD_HEADER.unpack_from(self._map, offset)
+                offset += RECORD_HEADER.size
+                if ((kinds is None or kind in kinds) and (start is None or timestamp >= start)
+                        and (end is None or timestamp <= end)):
+                    yield Record(timestamp, kind, view[offset:offset + size])
+                offset += size
+
+    @staticmethod
+    def decode_frame(record):
+        """
+        Returns:
+            (int, ndarray): sequence and frame. Raw frames are read only views of the file
+        """
+        sequence, height, width, channels = FRAME_HEADER.unpack_from(record.data)
+        data = record.data[FRAME_HEADER.size:]
+        if record.kind == FRAME_RAW:
+            shape = (height, width, channels) if channels > 1 else (height, width)
+            return sequence, np.frombuffer(data, dtype=np.uint8).reshape(shape)
+        return sequence, cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+    @staticmethod
+    def decode_json(record):
+        return json.loads(bytes(record.data).decode('utf-8'))
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,195 @@
+import bisect
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+# Upper bounds (in seconds) of the latency buckets, from sub-millisecond steps to slow commands
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and math.isnan(value):
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels, extra=()):
+    """ {name="value",...} of the labels followed by the (name, value) pairs of extra, '' without any """
+    pairs = sorted(labels.items()) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join('{}="{}"'.format(name, value) for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Registry:
+    """ Metrics in the order they were created, rendered in the Prometheus text format """
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Metrics of the same name with different labels are one family
+        families = OrderedDict()
+        for metric in list(self.metrics):
+            families.setdefault(metric.name, []).append(metric)
+
+        lines = []
+        for name, metrics in families.items():
+            lines.append('# HELP {} {}'.format(name, metrics[0].help))
+            lines.append('# TYPE {} {}'.format(name, metrics[0].kind))
+            for metric in metrics:
+                # Once there are labeled children, they replace the unlabeled metric
+                if metric.children:
+                    continue
+                for suffix, labels, value in metric.samples():
+                    lines.append('{}{}{} {}'.format(name, suffix, labels, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+# Creating a child registers it, so this is not the lock of the registry
+_children_lock = threading.Lock()
+
+
+class Metric:
+    """ Name, help and labels of a metric. labels() gives the metric for a label set, e.g. one per drone """
+    kind = None
+
+    def __init__(self, name, help, registry, labels):
+        self.name = name
+        self.help = help
+        self.registry = registry
+        self.label_values = dict(labels or {})
+        self.children = {}
+        registry.register(self)
+
+    def labels(self, **labels):
+        """ The child metric with these labels in addition to its own, created on first use """
+        if not labels:
+            return self
+        key = tuple(sorted(labels.items()))
+        with _children_lock:
+            if key not in self.children:
+                self.children[key] = self.create_child(dict(self.label_values, **labels))
+            return self.children[key]
+
+    def create_child(self, labels):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """ A value that only goes up """
+    kind = 'counter'
+
+    def __init__(self, name, help, registry=REGISTRY, labels=None):
+        self.value = 0
+        self.lock = threading.Lock()
+        Metric.__init__(self, name, help, registry, labels)
+
+    def create_child(self, labels):
+        return Counter(self.name, self.help, self.registry, labels)
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [('', format_labels(self.label_values), self.value)]
+
+
+class Gauge(Metric):
+    """ A value that is set, or read from function when the metrics are rendered """
+    kind = 'gauge'
+
+    def __init__(self, name, help, function=None, registry=REGISTRY, labels=None):
+        self.value = 0
+        self.function = function
+        Metric.__init__(self, name, help, registry, labels)
+
+    def create_child(self, labels):
+        return type(self)(self.name, self.help, self.function, self.registry, labels)
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        labels = format_labels(self.label_values)
+        if self.function is None:
+            return [('', labels, self.value)]
+        try:
+            value = self.function()
+        except Exception:
+            # What it reads is not there yet, e.g. before the drone is connected
+            value = math.nan
+        return [('', labels, value if value is not None else math.nan)]
+
+
+class CounterFunction(Gauge):
+    """ A counter kept elsewhere, read from function when the metrics are rendered """
+    kind = 'counter'
+
+    def __init__(self, name, help, function, registry=REGISTRY, labels=None):
+        Gauge.__init__(self, name, help, function, registry, labels)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in fixed buckets. observe() costs a binary search and one increment under a
+    lock, so it can stay on in the hot paths. The buckets are cumulated only when the metrics are rendered.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS, registry=REGISTRY, labels=None):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+        Metric.__init__(self, name, help, registry, labels)
+
+    def create_child(self, labels):
+        return Histogram(self.name, self.help, self.buckets, self.registry, labels)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def timed(self, fn):
+        """ Decorator that observes the run time of every call of fn """
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - start)
+        return wrapper
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        labels = format_labels(self.label_values)
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            samples.append(('_bucket', format_labels(self.label_values, [('le', format_value(bound))]), cumulative))
+        samples.append(('_sum', labels, total))
+        samples.append(('_count', labels, cumulative))
+        return samples
@@ -0,0 +1,296 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import numpy as np
+from face_detectors import FaceDetector, create_detector
+from face_embedders import FaceEmbedder, get_embedder
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+# Longest wait for a response of the service (s)
+REQUEST_TIMEOUT = 10.0
+# Longest wait for the service processes to load their models (s)
+START_TIMEOUT = 120.0
+# How often a waiting caller checks that the service processes are still alive (s)
+POLL_INTERVAL = 0.5
+
+
+def serve(memory_name, slot_size, requests, responses, detector, detector_options, embedder, embedder_options):
+    """Main function of a service process. Takes (request id, slot, shape, dtype, operation, arguments) from
+    requests, reads the frame from its slot of the shared memory without copying and puts
+    (request id, result, error) on responses.
+    """
+    try:
+        detector = create_detector(detector, **detector_options)
+        embedder = get_embedder(embedder, **embedder_options)
+    except Exception as e:
+        responses.put((None, None, "{}: {}".format(type(e).__name__, e)))
+        return
+
+    # Spawned processes share the resource tracker of the app, which unlinks the memory
+    memory = shared_memory.SharedMemory(memory_name)
+
+    responses.put((None, {'version': embedder.version, 'size': embedder.size, 'tolerance': embedder.tolerance},
+                   None))
+
+    try:
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+
+            request_id, slot, shape, dtype, operation, arguments = request
+            frame = np.ndarray(shape, dtype, buffer=memory.buf, offset=slot * slot_size)
+            try:
+                if operation == 'detect':
+                    result = [tuple(int(v) for v in box) for box in detector.detect(frame)]
+                else:
+                    result = [None if encoding is None else np.asarray(encoding, dtype=np.float32)
+                              for encoding in embedder.encode(frame, arguments)]
+                responses.put((request_id, result, None))
+            except Exception as e:
+                responses.put((request_id, None, "{}: {}".format(type(e).__name__, e)))
+            finally:
+                del frame
+    finally:
+        memory.close()
+
+
+class RecognitionService(object):
+    """
+    Face detection and encoding in separate processes, so dlib does not hold the GIL of the control loop and Flask.
+    Frames go through a ring of slots in shared memory: the caller copies a frame into a free slot once and only
+    (slot, shape, operation, boxes) is pickled. Boxes and encodings come back over a queue. Any process of the pool
+    takes the next request. detector and embedder are drop-in replacements of the in-process ones.
+    """
+
+    def __init__(self, processes=1, frame_size=(960, 720), slots=None, detector='hog', detector_options=None,
+                 embedder='dlib', embedder_options=None):
+        """
+        Arguments:
+            processes: service processes, each loads its own copy of the models
+            frame_size: (width, height) of the largest BGR frame that is sent
+            slots: frames in shared memory at once, at least one per thread that calls detect or encode. A thread
+                holds its slot until release()
+            detector, embedder: names and options as for create_detector and get_embedder
+        """
+        if shared_memory is None:
+            raise RuntimeError("The recognition service needs multiprocessing.shared_memory (Python 3.8)")
+
+        self.processes = processes
+        self.slot_size = frame_size[0] * frame_size[1] * 3
+        self.slots = slots or processes + 4
+        self.config = (detector, detector_options or {}, embedder, embedder_options or {})
+
+        self.memory = None
+        self.requests = None
+        self.responses = None
+        self.workers = []
+        self.stopped = False
+
+        # Each calling thread keeps the slot of its newest frame until release(), detect and encode of one frame
+        # share it
+        self._free_slots = queue.Queue()
+        self._local = threading.local()
+
+        self._futures = {}
+        self._request_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self.detector = None
+        self.embedder = None
+
+    def start(self):
+        """Start the processes and wait until they have loaded the models
+        Raises:
+            IOError: a model could not be loaded
+        """
+        self.memory = shared_memory.SharedMemory(create=True, size=self.slot_size * self.slots)
+        for slot in range(self.slots):
+            self._free_slots.put(slot)
+
+        # spawn, so the processes do not inherit the threads and sockets of the app
+        context = multiprocessing.get_context('spawn')
+        self.requests = context.Queue()
+        self.responses = context.Queue()
+        for _ in range(self.processes):
+            process = context.Process(target=serve, args=(self.memory.name, self.slot_size, self.requests,
+                                                          self.responses) + self.config)
+            process.daemon = True
+            process.start()
+            self.workers.append(process)
+
+        info = None
+        ready = 0
+        deadline = time.time() + START_TIMEOUT
+        while ready < self.processes:
+            try:
+                _, info, error = self.responses.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # A process that died while starting never answers
+                error = self.dead_workers()
+                if error is None and time.time() > deadline:
+                    error = "no response within {} s".format(START_TIMEOUT)
+                if error is None:
+                    continue
+            if error:
+                self.close()
+                raise IOError("Recognition service failed to start: {}".format(error))
+            ready += 1
+
+        self.detector = RemoteDetector(self)
+        self.embedder = RemoteEmbedder(self, self.config[2], options=self.config[3], **info)
+
+        thread = threading.Thread(target=self.run_receiver, args=())
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def run_receiver(self):
+        """ Hands the responses to the waiting callers """
+        while not self.stopped:
+            try:
+                request_id, result, error = self.responses.get()
+            except (EOFError, OSError):
+                break
+            if request_id is None:
+                break
+
+            with self._lock:
+                future = self._futures.pop(request_id, None)
+            if future is None:
+                continue
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+
+    def slot_of(self, frame):
+        """ The slot holding frame, copied into a free slot unless it is this thread's newest frame """
+        local = self._local
+        if getattr(local, 'frame', None) is frame:
+            return local.slot
+
+        if frame.nbytes > self.slot_size:
+            raise ValueError("Frame of {} bytes does not fit a slot of {} bytes, raise frame_size".format(
+                frame.nbytes, self.slot_size))
+
+        # This thread is done with its previous frame
+        self.release()
+
+        try:
+            slot = self._free_slots.get(timeout=REQUEST_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError("No free frame slot within {} s, all {} are held by other threads. Call release() "
+                               "after each frame or raise slots".format(REQUEST_TIMEOUT, self.slots))
+        view = np.ndarray(frame.shape, frame.dtype, buffer=self.memory.buf, offset=slot * self.slot_size)
+        view[...] = frame
+        local.slot, local.frame = slot, frame
+        return slot
+
+    def release(self):
+        """ Give the slot of this thread's newest frame back, once detect and encode of the frame are done """
+        local = self._local
+        if getattr(local, 'slot', None) is not None:
+            self._free_slots.put(local.slot)
+            local.slot = local.frame = None
+
+    def dead_workers(self):
+        """ Why the service can not answer anymore, None while all processes are alive """
+        if self.stopped:
+            return "recognition service closed"
+        for process in self.workers:
+            if process.exitcode is not None:
+                return "recognition process {} exited with code {}".format(process.pid, process.exitcode)
+        return None
+
+    def call(self, operation, frame, arguments=None):
+        """Raises:
+            RuntimeError: the operation failed, a service process has died or there was no response in time
+        """
+        error = self.dead_workers()
+        if error:
+            raise RuntimeError(error)
+
+        slot = self.slot_of(frame)
+        future = Future()
+        with self._lock:
+            request_id = next(self._request_ids)
+            self._futures[request_id] = future
+
+        self.requests.put((request_id, slot, frame.shape, frame.dtype.str, operation, arguments))
+        deadline = time.time() + REQUEST_TIMEOUT
+        try:
+            while True:
+                try:
+                    return future.result(max(min(POLL_INTERVAL, deadline - time.time()), 0))
+                except FutureTimeoutError:
+                    error = self.dead_workers()
+                    if error is None and time.time() >= deadline:
+                        error = "no response within {} s".format(REQUEST_TIMEOUT)
+                    if error:
+                        # The request may still be read from the slot, so it is not handed out again
+                        self._local.slot = self._local.frame = None
+                        raise RuntimeError(error)
+        finally:
+            with self._lock:
+                self._futures.pop(request_id, None)
+
+    def close(self):
+        self.stopped = True
+        for _ in self.workers:
+            self.requests.put(None)
+        for process in self.workers:
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+        self.workers = []
+
+        # Ends the receiver
+        if self.responses is not None:
+            self.responses.put((None, None, None))
+
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+
+class RemoteDetector(FaceDetector):
+    """ The detector of a RecognitionService """
+    name = 'remote'
+
+    def __init__(self, service):
+        self.service = service
+
+    def detect(self, frame):
+        return self.service.call('detect', frame)
+
+
+class RemoteEmbedder(FaceEmbedder):
+    """ The embedder of a RecognitionService, with the version, size and tolerance of the one it runs """
+
+    def __init__(self, service, name, version, size, tolerance, options=None):
+        self.service = service
+        self.name = name
+        self.options = options or {}
+        self.version = version
+        self.size = size
+        self.tolerance = tolerance
+
+    def encode(self, frame, face_locations):
+        if len(face_locations) == 0:
+            return []
+        return self.service.call('encode', frame, [tuple(int(v) for v in box) for box in face_locations])
+
+    def encode_file(self, path):
+        try:
+            return FaceEmbedder.encode_file(self, path)
+        finally:
+            self.service.release()
@@ -0,0 +1,233 @@
+import threading
+import time
+from collections import namedtuple
+from threading import Thread
+
+# Faces found in one frame. sequence and timestamp identify the frame the result was computed from, frame is that
+# (untouched) frame itself, face_locations are (top, right, bottom, left) in its coordinates. track_ids holds the
+# track a face continues (or None for a new face) and encoded_at when its encoding was computed
+DetectionResult = namedtuple('DetectionResult', ['sequence', 'timestamp', 'frame', 'face_locations',
+                                                 'face_encodings', 'face_names', 'track_ids', 'encoded_at',
+                                                 'duration'])
+
+
+class RecognitionWorker:
+    """
+    This class runs face detection and recognition on a background thread, so the control loop and the video stream
+    are not blocked by it. Frames are handed over through a single slot: if the worker is still busy, a newer frame
+    replaces the one waiting. Then, just read recognitionWorker.result to get the newest result.
+    With inline=True, submit processes the frame itself instead, so every submitted frame gets its result before the
+    next one, which makes replays repeatable.
+    """
+
+    def __init__(self, process_frame, inline=False):
+        """
+        Arguments:
+            process_frame: function that takes a frame and the tracks and search region submitted with it and returns
+                (face_locations, face_encodings, face_names, track_ids, encoded_at)
+            inline: run process_frame in submit, on the calling thread
+        """
+        self.process_frame = process_frame
+        self.inline = inline
+        self.result = None
+        self.stopped = False
+
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+        self.frames_processed = 0
+
+        self._pending = None
+        self._condition = threading.Condition()
+
+    def start(self):
+        if self.inline:
+            return self
+        thread = Thread(target=self.run, args=())
+        thread.daemon = True
+        thread.start()
+        return self
+
+    @property
+    def queue_depth(self):
+        """ Frames waiting for the worker, 0 or 1 """
+        return 0 if self._pending is None else 1
+
+    def submit(self, frame, sequence, timestamp=None, tracks=(), search_region=None):
+        """Offer a frame to the worker. The frame must not be modified afterwards.
+        Arguments:
+            tracks: snapshot of the tracks in this frame, to reuse their identities
+            search_region: (top, right, bottom, left) to search faces in, None for the whole frame
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        if self.inline:
+            self.frames_submitted += 1
+            self.process(sequence, timestamp, frame, tracks, search_region)
+            return
+
+        with self._condition:
+            if self._pending is not None:
+                self.frames_dropped += 1
+            self._pending = (sequence, timestamp, frame, tracks, search_region)
+            self.frames_submitted += 1
+            self._condition.notify()
+
+    def run(self):
+        while not self.stopped:
+            with self._condition:
+                while self._pending is None and not self.stopped:
+                    self._condition.wait()
+                if self.stopped:
+                    break
+                sequence, timestamp, frame, tracks, search_region = self._pending
+                self._pending = None
+
+            self.process(sequence, timestamp, frame, tracks, search_region)
+
+    def process(self, sequence, timestamp, frame, tracks, search_region):
+        start = time.time()
+        try:
+            faces = self.process_frame(frame, tracks, search_region)
+        except Exception as e:
+            print("Recognition failed: {}".format(e))
+            return
+
+        self.frames_processed += 1
+        # Replacing the reference is atomic, readers always see a complete result
+        self.result = DetectionResult(sequence, timestamp, frame, *faces, duration=time.time() - start)
+
+    def stop(self):
+        with self._condition:
+            self.stopped = True
+            self._condition.notify()
+
+
+class RecognitionPool:
+    """
+    Recognition threads shared by several drones, so the models and the gallery are only loaded once. Every drone
+    submits through its own client, which keeps a single slot like RecognitionWorker. A free thread takes the oldest
+    waiting frame of all clients, so the drones are served in turn by frame age and a drone that submits often can
+    not starve the others. A client has at most one frame in recognition, its results stay in order.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.clients = []
+        self.started = False
+        self.stopped = False
+
+        self._condition = threading.Condition()
+
+    def client(self, process_frame):
+        """ A RecognitionWorker lookalike for one drone, see RecognitionWorker for process_frame """
+        client = RecognitionClient(self, process_frame)
+        with self._condition:
+            self.clients.append(client)
+        return client
+
+    def start(self):
+        with self._condition:
+            if self.started:
+                return self
+            self.started = True
+
+        for _ in range(self.workers):
+            thread = Thread(target=self.run, args=())
+            thread.daemon = True
+            thread.start()
+        return self
+
+    @property
+    def queue_depth(self):
+        """ Frames waiting for a worker, at most one per client """
+        return sum(client.queue_depth for client in list(self.clients))
+
+    def next_frame(self):
+        """ Wait for the oldest frame of a client that is not busy, None once stopped """
+        with self._condition:
+            while not self.stopped:
+                waiting = [client for client in self.clients
+                           if client._pending is not None and not client.busy and not client.stopped]
+                if waiting:
+                    client = min(waiting, key=lambda c: c._pending[1])
+                    pending = client._pending
+                    client._pending = None
+                    client.busy = True
+                    return client, pending
+                self._condition.wait()
+        return None
+
+    def run(self):
+        while True:
+            job = self.next_frame()
+            if job is None:
+                break
+
+            client, (sequence, timestamp, frame, tracks, search_region) = job
+            start = time.time()
+            try:
+                faces = client.process_frame(frame, tracks, search_region)
+                client.frames_processed += 1
+                client.result = DetectionResult(sequence, timestamp, frame, *faces, duration=time.time() - start)
+            except Exception as e:
+                print("Recognition failed: {}".format(e))
+            finally:
+                with self._condition:
+                    client.busy = False
+                    # A frame of this client may have come in meanwhile
+                    self._condition.notify()
+
+    def remove(self, client):
+        with self._condition:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def stop(self):
+        with self._condition:
+            self.stopped = True
+            self._condition.notify_all()
+
+
+class RecognitionClient:
+    """ One drone's slot in a RecognitionPool, used like a RecognitionWorker """
+
+    def __init__(self, pool, process_frame):
+        self.pool = pool
+        self.process_frame = process_frame
+        self.result = None
+        self.stopped = False
+        self.busy = False
+
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+        self.frames_processed = 0
+
+        self._pending = None
+
+    def start(self):
+        """ Starts the pool on first use """
+        self.pool.start()
+        return self
+
+    @property
+    def queue_depth(self):
+        """ Frames waiting for the pool, 0 or 1 """
+        return 0 if self._pending is None else 1
+
+    def submit(self, frame, sequence, timestamp=None, tracks=(), search_region=None):
+        """ See RecognitionWorker.submit, the timestamp decides the order across drones """
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self.pool._condition:
+            if self._pending is not None:
+                self.frames_dropped += 1
+            self._pending = (sequence, timestamp, frame, tracks, search_region)
+            self.frames_submitted += 1
+            self.pool._condition.notify()
+
+    def stop(self):
+        """ Leaves the pool, the other drones keep using it """
+        self.stopped = True
+        self.pool.remove(self)
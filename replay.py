@@ -0,0 +1,182 @@
+# Replay a flight recording through DroneControl, without a drone.
+# Every recorded frame goes through loop() once, as fast as possible or at a multiple of real time:
+#   python replay.py flight_recordings/<date>.tfr [speed] [--async]
+# Recognition runs in the loop on every submitted frame, so a replay gives the same detections and RC commands each
+# time. --async uses the background worker of a flight instead, which drops frames depending on the timing.
+
+import sys
+import argparse
+import time
+from concurrent.futures import Future
+import numpy as np
+from flight_recorder import FlightRecording, FRAME_KINDS, TELEMETRY, COMMAND
+from telloFaceDelivery import DroneControl
+
+
+class ReplayFrameRead:
+    """Stands in for BackgroundFrameRead. wait_for_new_frame hands out the next recorded frame and applies the
+    telemetry recorded before it. With a speed, frames are handed out at that multiple of the recorded pace.
+    """
+
+    def __init__(self, tello, records, speed=None):
+        self.tello = tello
+        self.records = records
+        self.speed = speed
+
+        self.frame = None
+        self.timestamp = None
+        self.sequence = 0
+        self.stopped = False
+
+        self._start = None
+
+    def wait_for_new_frame(self, last_sequence, timeout=None):
+        record = None
+        if not self.stopped:
+            for record in self.records:
+                if record.kind == TELEMETRY:
+                    self.tello.state = (record.timestamp, FlightRecording.decode_json(record))
+                elif record.kind in FRAME_KINDS:
+                    break
+            else:
+                record = None
+
+        if record is None:
+            self.stop()
+            return last_sequence, None, None
+
+        if self.speed:
+            if self._start is None:
+                self._start = (time.time(), record.timestamp)
+            delay = self._start[0] + (record.timestamp - self._start[1]) / self.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        _, self.frame = FlightRecording.decode_frame(record)
+        self.timestamp = record.timestamp
+        self.sequence += 1
+        return self.sequence, self.frame, self.timestamp
+
+    def stop(self):
+        self.stopped = True
+
+
+class ReplayTello:
+    """Stands in for Tello in DroneControl. Commands succeed right away, the state is the recorded telemetry and
+    the RC velocities DroneControl sends are collected in rc_changes.
+    """
+
+    def __init__(self, recording, speed=None):
+        self.recording = recording
+        self.state = None
+        self.recorder = None
+        self.frame_read = ReplayFrameRead(self, recording.records(kinds=FRAME_KINDS + (TELEMETRY,)), speed)
+
+        # (timestamp, velocities) whenever the velocities change
+        self.rc_changes = []
+
+    def connect(self):
+        return True
+
+    def set_speed(self, x):
+        return True
+
+    def streamon(self):
+        return True
+
+    def streamoff(self):
+        return True
+
+    def start_rc_sender(self, rate=None, skip_zero=False):
+        return None
+
+    def send_rc_control(self, left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity):
+        velocities = (left_right_velocity, forward_backward_velocity, up_down_velocity, yaw_velocity)
+        if not self.rc_changes or self.rc_changes[-1][1] != velocities:
+            self.rc_changes.append((self.frame_read.timestamp, velocities))
+
+    def send_control_command_async(self, command):
+        future = Future()
+        future.set_result(True)
+        return future
+
+    def get_frame_read(self):
+        return self.frame_read
+
+    def get_state_field(self, key):
+        state = self.state
+        if state is None or key not in state[1]:
+            return False
+        return state[1][key]
+
+    def get_state_age(self):
+        """ Age of the state at the time of the current frame """
+        if self.state is None or self.frame_read.timestamp is None:
+            return None
+        return self.frame_read.timestamp - self.state[0]
+
+    def get_battery(self):
+        return self.get_state_field('bat')
+
+    def get_height(self):
+        return self.get_state_field('h')
+
+    def end(self):
+        self.frame_read.stop()
+
+
+def recorded_rc_changes(recording):
+    """ The RC velocities sent during the recorded flight, whenever they changed """
+    changes = []
+    for record in recording.records(kinds=(COMMAND,)):
+        command = FlightRecording.decode_json(record)['command'].split()
+        if command[0] != 'rc':
+            continue
+        velocities = tuple(int(v) for v in command[1:])
+        if not changes or changes[-1][1] != velocities:
+            changes.append((record.timestamp, velocities))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a flight recording through DroneControl')
+    parser.add_argument('recording', help='.tfr file of the flight recorder')
+    parser.add_argument('speed', type=float, nargs='?', help='multiple of real time, by default as fast as possible')
+    parser.add_argument('--async', dest='asynchronous', action='store_true',
+                        help='recognize on the background worker like in flight, results depend on the timing')
+    args = parser.parse_args()
+    speed = args.speed
+
+    recording = FlightRecording(args.recording)
+    if not recording.chunks:
+        print("Empty recording")
+        sys.exit(1)
+    print("{} records, {:.1f} s recorded".format(len(recording), recording.end_time - recording.start_time))
+
+    tello = ReplayTello(recording, speed)
+    start = time.time()
+    drone = DroneControl(tello, inline_recognition=not args.asynchronous)
+
+    loop_times = []
+    while not tello.frame_read.stopped:
+        loop_start = time.time()
+        drone.loop()
+        loop_times.append(time.time() - loop_start)
+    elapsed = time.time() - start
+
+    # Not drone.shutdown(), it needs a GUI build of OpenCV
+    drone.recognition_worker.stop()
+    tello.end()
+
+    frames = tello.frame_read.sequence
+    loop_ms = np.array(loop_times) * 1000 if loop_times else np.zeros(1)
+    worker = drone.recognition_worker
+    print("{} frames in {:.2f} s: {:.1f} fps, {:.1f}x real time".format(
+        frames, elapsed, frames / elapsed, (recording.end_time - recording.start_time) / elapsed))
+    print("loop() p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms".format(*np.percentile(loop_ms, [50, 95, 99])))
+    print("detections: {} processed, {} dropped".format(worker.frames_processed, worker.frames_dropped))
+    print("rc changes: {} recorded, {} replayed".format(len(recorded_rc_changes(recording)), len(tello.rc_changes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,35 @@
 # Extended / reworked by Luca Fluri & Dario Breitenstein
 
 from djitellopy import Tello
-import face_recognition
+from face_gallery import FaceGallery
+from face_index import load_or_build
+from encoding_cache import EncodingCache
+from enrollment import encode_face_file, encode_face_files
+from recognition_worker import RecognitionWorker
+from face_tracker import FaceTracker, match_tracks
+from face_detectors import create_detector
+from face_embedders import get_embedder
+from recognition_service import RecognitionService
+from video_stream import FrameBroadcaster
+from flight_recorder import FlightRecorder
+from metrics import REGISTRY, Counter, CounterFunction, Gauge, Histogram
 import cv2
 import numpy as np
 import datetime
+import time
 import os, sys
 import shutil
 import uuid
 from flask import Flask, render_template, Response, jsonify, request, send_from_directory, redirect, url_for
 from flask_cors import CORS
 
+# Address of the drone. Set TELLO_HOST (e.g. 127.0.0.1) to fly the local simulator, python -m djitellopy.simulator
+tello_host = os.environ.get("TELLO_HOST")
+
+# Record every flight to flight_recordings/<date>.tfr, for analysis and replay (python replay.py <file>)
+flight_recording = False
+flight_recording_folder = "flight_recordings"
+
 # Speed of the drone
 v_yaw_pitch = 100
 v_for_back = 15
@@ -26,18 +45,133 @@ depth_tolerance = 50
 
 detection_wait_interval = 10
 
+# Faces are detected on a frame downscaled by this factor
+capture_divider = 0.5
+
+# Face detector: hog (dlib), dnn (OpenCV res10 SSD), haar or lbp (OpenCV cascades), and its constructor options,
+# e.g. {"confidence": 0.6} for dnn. benchmarks/bench_detectors.py compares their speed and recall
+face_detector = "hog"
+face_detector_options = {}
+
+# Face embedder: dlib, sface (OpenCV DNN, {"int8": True} for the quantized model) or openface, and its constructor
+# options. Every embedder keeps its own encoding cache. benchmarks/bench_embedders.py compares them
+face_embedder = "dlib"
+face_embedder_options = {}
+
+# Run detection and encoding in this many separate processes, so dlib does not hold the GIL of the control loop and
+# Flask. Frames are passed through shared memory. 0 runs them on the recognition thread of this process. More than
+# one process only pays off with several recognition_workers in fleet mode
+recognition_processes = 0
+
+# Between detections the faces are tracked. Detect again every detection_interval frames,
+# or earlier when the tracker loses too many of its points
+detection_interval = 10
+tracker_min_confidence = 0.5
+
+# A detected face keeps the encoding of the track it overlaps by at least identity_iou_threshold,
+# for up to identity_refresh_interval seconds
+identity_iou_threshold = 0.5
+identity_refresh_interval = 2.0
+
+# Once a target is known, faces are only searched in a region around it, padded by roi_padding face sizes
+# on each side and detected at roi_scale (1.0 = full resolution). This finds smaller, more distant faces
+# in less time. After detection_wait_interval detections without the target, the whole frame is searched again
+roi_padding = 1.0
+roi_scale = 1.0
+
+# RC commands are sent at this fixed rate (Hz). Optionally repeated zero commands are skipped, apart from keepalives
+rc_control_rate = 20
+rc_skip_zero = False
+
+# Processes used to encode the known faces on a cold start, None for one per core
+enrollment_processes = None
+
+# From ann_min_gallery_size known faces on, identify_faces searches an approximate index of the gallery (see
+# face_index.py) and only ranks its candidates exactly. It is kept next to the encoding cache and updated on exit.
+# storage pq scans 16 bytes per face, float16 256 and float32 512. More nprobe finds more true matches but is slower.
+# benchmarks/bench_face_index.py reports recall and latency against the exact scan. None always scans all faces
+ann_min_gallery_size = 20000
+ann_options = {"nprobe": 8, "storage": "pq", "rerank": 32}
+
+# Fleet mode (python fleet.py fleet.json) flies several drones from this host. They share one gallery and
+# recognition_workers threads, which always take the oldest waiting frame of any drone
+recognition_workers = 1
+
 # Frames per second of the window display
 FPS = 25
 dimensions = (960, 720)
 
+# Longest time loop() waits for a new video frame (s)
+frame_timeout = 1.0
+
 # Face Recognition
 unknown_face_name = "unknown"
 target_name = ""
 
+# Metrics, served on /metrics in the Prometheus text format
+loop_seconds = Histogram('tello_loop_seconds', 'Time loop() spends on a new frame')
+frame_age_seconds = Histogram('tello_frame_age_seconds', 'Age of a frame when loop() starts on it')
+frames_processed = Counter('tello_frames_processed_total', 'Frames loop() processed')
+frame_timeouts = Counter('tello_frame_timeouts_total', 'Times loop() waited frame_timeout without a new frame')
+detection_seconds = Histogram('tello_detection_seconds', 'Time the recognition worker spends on a frame')
+detection_latency_seconds = Histogram('tello_detection_latency_seconds',
+                                      'Time from the capture of a frame until loop() uses its detection')
+identify_faces_seconds = Histogram('tello_identify_faces_seconds', 'Time of identify_faces()')
+approach_target_seconds = Histogram('tello_approach_target_seconds', 'Time of approach_target()')
+update_rc_control_seconds = Histogram('tello_update_rc_control_seconds', 'Time of update_rc_control()')
+command_seconds = Histogram('tello_command_seconds', 'Time of a Tello command until its response, queueing included')
+stream_frames = Counter('tello_stream_frames_total', 'JPEG frames sent to viewers')
+stream_bytes = Counter('tello_stream_bytes_total', 'Bytes sent to viewers')
+Gauge('tello_stream_viewers', 'Open video streams', lambda: broadcaster.viewers)
+
+def register_drone_metrics(drone, labels):
+    """ The metrics read from a DroneControl when they are rendered, under labels """
+    Gauge('tello_recognition_queue_depth', 'Frames waiting for the recognition worker',
+          lambda: drone.recognition_worker.queue_depth, labels=labels)
+    CounterFunction('tello_recognition_frames_submitted_total', 'Frames handed to the recognition worker',
+                    lambda: drone.recognition_worker.frames_submitted, labels=labels)
+    CounterFunction('tello_recognition_frames_dropped_total', 'Frames replaced by a newer one before recognition',
+                    lambda: drone.recognition_worker.frames_dropped, labels=labels)
+    CounterFunction('tello_video_frames_decoded_total', 'Video frames decoded',
+                    lambda: drone.tello.get_frame_read().frames_decoded, labels=labels)
+    CounterFunction('tello_video_decode_errors_total', 'Video packets the decoder rejected',
+                    lambda: drone.tello.get_frame_read().decode_errors, labels=labels)
+    CounterFunction('tello_command_timeouts_total', 'Commands without response', lambda: drone.tello.command_timeouts,
+                    labels=labels)
+    CounterFunction('tello_stale_responses_total', 'Responses that came too late',
+                    lambda: drone.tello.stale_responses, labels=labels)
+    CounterFunction('tello_rc_packets_sent_total', 'RC commands sent', lambda: drone.tello.rc_sender.packets_sent,
+                    labels=labels)
+    Gauge('tello_state_age_seconds', 'Age of the newest state packet', lambda: drone.tello.get_state_age(),
+          labels=labels)
+    Gauge('tello_battery_percent', 'Battery of the drone', lambda: drone.tello.get_battery(), labels=labels)
+
 class DroneControl(object):
-    def __init__(self):
-        # Init Tello object that interacts with the Tello drone
-        self.tello = Tello()
+    def __init__(self, tello=None, fleet=None, name=None, inline_recognition=False):
+        """
+        Arguments:
+            tello: the Tello to fly, by default the one at tello_host
+            fleet: FleetManager whose detector, embedder, gallery and recognition pool this drone shares
+            name: of the drone in the fleet, part of its flight recording file name
+        """
+        # Init Tello object that interacts with the Tello drone, or the stand-in that is passed
+        if tello is not None:
+            self.tello = tello
+        elif tello_host:
+            # The simulator may use port 8889 on this host, so the responses come back on any free port
+            self.tello = Tello(tello_host, local_command_port=0)
+        else:
+            self.tello = Tello()
+
+        # The metrics of this drone, labeled with its name in a fleet
+        metric_labels = {'drone': name} if name else {}
+        self.loop_seconds = loop_seconds.labels(**metric_labels)
+        self.frame_age_seconds = frame_age_seconds.labels(**metric_labels)
+        self.frames_processed = frames_processed.labels(**metric_labels)
+        self.frame_timeouts = frame_timeouts.labels(**metric_labels)
+        self.detection_seconds = detection_seconds.labels(**metric_labels)
+        self.detection_latency_seconds = detection_latency_seconds.labels(**metric_labels)
+        register_drone_metrics(self, metric_labels)
 
         # Drone velocities between -100~100
         self.for_back_velocity = 0
@@ -52,23 +186,78 @@ class DroneControl(object):
         # Enroll mode: Try to find new faces
         self.enroll_mode = False
 
-        # Create arrays of known face encodings and their names
-        self.known_face_encodings = []
-        self.known_face_names = []
+        self.fleet = fleet
+        self.name = name
+        if fleet is None:
+            # Finds the faces in a frame and turns them into encodings, fails right away if a model is missing.
+            # The gallery and its cache hold encodings of this embedder only
+            self.detector, self.embedder, self.recognition_service = create_models()
+
+            # Known face encodings and their names
+            self.gallery = FaceGallery(self.embedder.tolerance, self.embedder.size)
+            self.encoding_cache = EncodingCache("known_faces", encoding_size=self.embedder.size,
+                                                model=self.embedder.version)
+        else:
+            # One copy of the models and the known faces for the whole fleet, faces enrolled by any drone are
+            # known to all of them
+            self.recognition_service = None
+            self.detector = fleet.detector
+            self.embedder = fleet.embedder
+            self.gallery = fleet.gallery
+            self.encoding_cache = fleet.encoding_cache
+
+        # Images that could not be enrolled and why
+        self.enrollment_failures = {}
 
         # Logic used for navigation
         self.face_locations = None
         self.face_encodings = None    
         self.target_name = ""
         self.has_face = False    
-        self.detect_faces = True
         self.wait = 0
 
-        self.load_all_faces()
+        # In a fleet, the first drone loads the known faces for all of them
+        if fleet is None or not fleet.faces_loaded:
+            self.load_all_faces()
+            if fleet is not None:
+                fleet.faces_loaded = True
+
+        # Detection and recognition run in the background on the newest frame, in a fleet on the shared pool.
+        # inline_recognition runs them in the loop on every submitted frame instead, for repeatable replays
+        if fleet is None:
+            self.recognition_worker = RecognitionWorker(self.recognize, inline_recognition)
+        else:
+            self.recognition_worker = fleet.recognition_pool.client(self.recognize)
+        self.frame_sequence = 0
+        self.result_sequence = None
+
+        # Moves the detected faces along on every frame in between
+        self.tracker = FaceTracker()
+        self.frames_since_submit = 0
+
+        # Last known box of the target and the number of detections it has been missing from
+        self.target_location = None
+        self.target_lost = 0
+
+        # Faces encoded by the recognition worker, and encodings reused from a track instead
+        self.encoder_calls = 0
+        self.encoder_calls_saved = 0
 
         # Video frame for Streaming
         self.frame_available = None
 
+        # Frames, detections, telemetry and commands are written by the recorder's own thread
+        self.tello.command_timer = command_seconds.labels(**metric_labels)
+
+        self.recorder = None
+        if flight_recording:
+            file_name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            if name:
+                file_name += "_" + name
+            path = os.path.join(flight_recording_folder, file_name + ".tfr")
+            self.recorder = FlightRecorder(path).start()
+            self.tello.recorder = self.recorder
+
         if not self.tello.connect():
             print("Tello not connected")
             raise Exception("Tello not connected")
@@ -77,6 +266,9 @@ class DroneControl(object):
             print("Not set speed to lowest possible")
             raise Exception("Not set speed to lowest possible")
 
+        # update_rc_control only sets the velocities, they are sent at a fixed rate
+        self.tello.start_rc_sender(rc_control_rate, rc_skip_zero)
+
         # In case streaming is on. This happens when we quit this program without the escape key.
         if not self.tello.streamoff():
             print("Could not stop video stream")
@@ -86,6 +278,7 @@ class DroneControl(object):
             print("Could not start video stream")
             raise Exception("Could not start video stream")
 
+        self.recognition_worker.start()
         self.loop()
     
     def loop(self):
@@ -95,37 +288,52 @@ class DroneControl(object):
             self.tello.get_frame_read().stop()
             self.shutdown()
 
-        video_frame = self.tello.get_frame_read().frame
-
-        # Resize the frame
-        capture_divider = 0.5
-        recognition_frame = cv2.resize(video_frame, (0, 0), fx=capture_divider, fy=capture_divider) #BGR is used, not RGB
-        
-        # Convert the image from BGR color (which OpenCV uses) to RGB color (which face_recognition uses)
-        # recognition_frame = bgr_recognition_frame[:, :, ::-1]
-
-        # Copy of the frame for capturing faces
-        if self.enroll_mode:
-            capture_frame = video_frame.copy()
-
-        # Only detect faces every other frame
-        if self.detect_faces:
-            self.face_locations = face_recognition.face_locations(recognition_frame)
-            self.face_encodings = face_recognition.face_encodings(recognition_frame, self.face_locations)
-            self.detect_faces = False
+        # Process every frame at most once, sleep until there is a new one
+        sequence, capture_frame, capture_time = self.tello.get_frame_read().wait_for_new_frame(self.frame_sequence,
+                                                                                               frame_timeout)
+        if sequence == self.frame_sequence:
+            self.frame_timeouts.inc()
+            return
+
+        start = time.perf_counter()
+        self.frame_age_seconds.observe(time.time() - capture_time)
+        self.frame_sequence = sequence
+        self.frames_since_submit += 1
+        if self.recorder is not None:
+            self.recorder.record_frame(capture_frame, sequence, capture_time)
+
+        # Boxes are drawn on a copy of the frame
+        video_frame = capture_frame.copy()
+
+        # Use the newest recognition result available
+        result = self.recognition_worker.result
+        new_result = result is not None and result.sequence != self.result_sequence
+        if new_result:
+            self.result_sequence = result.sequence
+            self.detection_seconds.observe(result.duration)
+            self.detection_latency_seconds.observe(time.time() - result.timestamp)
+            if self.recorder is not None:
+                self.recorder.record_detection(result.sequence, result.face_locations, result.face_names,
+                                               result.duration, result.timestamp)
+            self.face_locations = result.face_locations
+            self.face_encodings = result.face_encodings
+
+            # Restart tracking from the detection and catch up to the current frame
+            self.tracker.reset(result.frame, result.face_locations, result.face_names, result.face_encodings,
+                               result.track_ids, result.encoded_at)
+            if result.frame is not capture_frame:
+                self.tracker.update(capture_frame)
         else:
-            self.detect_faces = True
+            self.tracker.update(capture_frame)
 
         # Navigate Autonomously
-        if self.autonomous:
-            # Loop through detected faces
-            for (top, right, bottom, left), name in self.identify_faces(self.face_locations, self.face_encodings):
-                    # Scale back up face locations since the frame we detected in was scaled to 1/4 size
-                    top = int(top * 1/capture_divider)
-                    right = int(right * 1/capture_divider)
-                    bottom = int(bottom * 1/capture_divider)
-                    left = int(left * 1/capture_divider)
-                    
+        target_found = False
+        if self.autonomous and result is not None:
+            # Loop through tracked faces
+            for track in self.tracker.tracks:
+                    top, right, bottom, left = track.location
+                    name = track.name
+
                     x = left
                     y = top
                     w = right - left
@@ -145,11 +353,14 @@ class DroneControl(object):
                     if self.enroll_mode:
                         if name is unknown_face_name:
                             target_reached = self.approach_target(video_frame, top,right, bottom, left)
+                            self.target_location = track.location
+                            target_found = True
 
-                            if target_reached:
+                            # Capture only once per detection
+                            if target_reached and new_result:
                                 newUUID = uuid.uuid4()
                                 newFacePath = "new_faces/{}.png".format(newUUID)
-                                roi = capture_frame[y:y+h, x:x+w]
+                                roi = capture_frame[max(y, 0):y+h, max(x, 0):x+w]
                                 cv2.imwrite(newFacePath, roi)
         
                                 if self.load_face(newFacePath, str(newUUID)):
@@ -157,10 +368,12 @@ class DroneControl(object):
                             break
                     elif (self.target_name and name == self.target_name) or ((not self.target_name) and name != unknown_face_name):
                         target_reached = self.approach_target(video_frame, top,right, bottom, left)
+                        self.target_location = track.location
+                        target_found = True
                         break
 
-            # No Faces / Face lost
-            if len(self.face_encodings) == 0:
+            # No Faces / Face lost, counted in detections rather than frames
+            if new_result and len(result.face_locations) == 0:
                 # Wait for a bit if the stream has collapsed
                 if self.wait >= detection_wait_interval:
                     self.wait = 0
@@ -178,20 +391,52 @@ class DroneControl(object):
                 else:
                     self.wait += 1
 
+        if new_result:
+            self.target_lost = 0 if target_found else self.target_lost + 1
+
+        # Search around the target while it is known, otherwise the whole frame
+        search_region = None
+        if self.target_location is not None and self.target_lost < detection_wait_interval:
+            search_region = self.search_region(self.target_location)
+            cv2.rectangle(video_frame, (search_region[3], search_region[0]), (search_region[1], search_region[2]),
+                          (255, 255, 0), 1)
+
+        # Hand the untouched frame to the recognition worker. If it is still busy, the newest frame waits instead
+        if self.frames_since_submit >= detection_interval or self.tracker.confidence < tracker_min_confidence:
+            self.frames_since_submit = 0
+            self.recognition_worker.submit(capture_frame, self.frame_sequence, capture_time, self.tracker.snapshot(),
+                                           search_region)
+
         # Show video stream
         self.frame_available = video_frame
+
+        self.frames_processed.inc()
+        self.loop_seconds.observe(time.perf_counter() - start)
         #cv2.imshow("Tello Drone Delivery", video_frame)
             
     def shutdown(self):
         # On exit, print the battery
         print(self.get_battery())
 
+        self.recognition_worker.stop()
+        if self.recognition_service is not None:
+            self.recognition_service.close()
+
+        # A fleet saves the index of its shared gallery once
+        if self.fleet is None:
+            self.save_face_index()
+
+        if self.recorder is not None:
+            self.tello.recorder = None
+            self.recorder.close()
+
         # When everything done, release the capture
         cv2.destroyAllWindows()
         
         # Call it always before finishing. I deallocate resources.
         self.tello.end()
     
+    @update_rc_control_seconds.timed
     def update_rc_control(self):
         """ Update routine. Send velocities to Tello."""
         self.tello.send_rc_control(
@@ -202,50 +447,144 @@ class DroneControl(object):
 
     def get_battery(self):
         """ Get Tello battery state """
-        battery = self.tello.get_battery()
-        if battery:
-            return battery[:2]
-        else:
-            return False
+        return self.tello.get_battery()
+
+    def encode_face(self, file):
+        """ Encode the first face found in an image file. Returns None if there is no face """
+        result = encode_face_file(file, self.embedder)
+
+        if result.error:
+            self.enrollment_failures[file] = result.error
+            print("Could not enroll {}: {}".format(file, result.error))
+        return result.encoding
+
+    def encode_faces(self, files):
+        """ Encode a list of image files in parallel """
+        # The enrollment processes load the same embedder, the gallery holds encodings of one model only
+        results = encode_face_files(files, enrollment_processes, embedder=self.embedder.name,
+                                    embedder_options=self.embedder.options)
+
+        for result in results:
+            if result.error:
+                self.enrollment_failures[result.path] = result.error
+                print("Could not enroll {}: {}".format(result.path, result.error))
+        return [result.encoding for result in results]
 
     def load_face(self, file, name):
         """ Load and enroll a face from the File System """
-        face_img = face_recognition.load_image_file(file)
-        face_encodings = face_recognition.face_encodings(face_img)
+        face_encoding = self.encode_face(file)
 
-        if len(face_encodings) > 0:
-            self.known_face_encodings.append(face_encodings[0])   
-            self.known_face_names.append(name)
+        if face_encoding is not None:
+            self.gallery.append(face_encoding, name)
             return True
         return False
 
     def load_all_faces(self):
         """ Load and enroll all faces from the known_faces folder, then clear out the new_faces folder """
-        for face in os.listdir("known_faces/"):
-            print(face[:-4])
-            self.load_face("known_faces/" + face, face[:-4])
+        # Only new or changed images get encoded, the rest comes from the encoding cache
+        files, encodings = self.encoding_cache.sync(self.encode_faces)
+        self.gallery.load(encodings, [os.path.splitext(face)[0] for face in files])
+        print("{} known faces".format(len(self.gallery)))
+
+        if ann_min_gallery_size is not None and len(self.gallery) >= ann_min_gallery_size:
+            index = load_or_build(self.face_index_path(), self.gallery.encodings, self.gallery.names,
+                                  dimension=self.embedder.size, **ann_options)
+            self.gallery.use_index(index, ann_min_gallery_size)
         
         for file in os.listdir("new_faces/"):
             os.remove("new_faces/" + file)
 
+    def face_index_path(self):
+        """ The approximate index of the gallery is kept next to the encoding cache """
+        return os.path.splitext(self.encoding_cache.matrix_path)[0] + "_index.npz"
+
+    def save_face_index(self):
+        """ Keep the faces enrolled since the start in the saved index """
+        if self.gallery.index is not None:
+            self.gallery.index.save(self.face_index_path(), self.gallery.names, self.gallery.encodings)
+
+    def search_region(self, location):
+        """ The region around a face box in which to look for it again, as (top, right, bottom, left) """
+        top, right, bottom, left = location
+        pad_x = int((right - left) * roi_padding)
+        pad_y = int((bottom - top) * roi_padding)
+
+        return (max(top - pad_y, 0), min(right + pad_x, dimensions[0]),
+                min(bottom + pad_y, dimensions[1]), max(left - pad_x, 0))
+
+    def recognize(self, video_frame, tracks, search_region=None):
+        """ Detect and identify the faces in a frame. Runs on the recognition worker """
+        if search_region is None:
+            # Resize the frame
+            scale = capture_divider
+            offset_y, offset_x = 0, 0
+            region = video_frame
+        else:
+            # Only the region around the target, at higher resolution
+            scale = roi_scale
+            offset_y, offset_x = search_region[0], search_region[3]
+            region = video_frame[search_region[0]:search_region[2], search_region[3]:search_region[1]]
+
+        if scale != 1.0:
+            recognition_frame = cv2.resize(region, (0, 0), fx=scale, fy=scale) #BGR is used, not RGB
+        else:
+            recognition_frame = np.ascontiguousarray(region)
+        
+        # Convert the image from BGR color (which OpenCV uses) to RGB color (which face_recognition uses)
+        # recognition_frame = bgr_recognition_frame[:, :, ::-1]
+
+        try:
+            small_face_locations = self.detector.detect(recognition_frame)
+
+            # Scale back up face locations since the frame we detected in was scaled, and move them into the full frame
+            face_locations = [(int(top / scale) + offset_y, int(right / scale) + offset_x,
+                               int(bottom / scale) + offset_y, int(left / scale) + offset_x)
+                              for top, right, bottom, left in small_face_locations]
+
+            # Faces that continue a track keep its encoding. Only new faces, faces that moved too far and
+            # identities older than identity_refresh_interval are encoded again
+            now = time.time()
+            matched_tracks = match_tracks(face_locations, tracks, identity_iou_threshold)
+            stale = [i for i, track in enumerate(matched_tracks)
+                     if track is None or now - track.encoded_at > identity_refresh_interval]
+
+            new_encodings = self.embedder.encode(recognition_frame, [small_face_locations[i] for i in stale])
+        finally:
+            # The frame is not needed by the recognition processes anymore
+            service = self.fleet.recognition_service if self.fleet is not None else self.recognition_service
+            if service is not None:
+                service.release()
+        self.encoder_calls += len(stale)
+        self.encoder_calls_saved += len(face_locations) - len(stale)
+
+        face_encodings = [track.encoding if track is not None else None for track in matched_tracks]
+        track_ids = [track.id if track is not None else None for track in matched_tracks]
+        encoded_at = [track.encoded_at if track is not None else None for track in matched_tracks]
+        for i, encoding in zip(stale, new_encodings):
+            # A face that could not be encoded keeps the encoding of its track, if any
+            if encoding is not None:
+                face_encodings[i] = encoding
+                encoded_at[i] = now
+
+        # Matching is cheap, so cached encodings are still matched against the current gallery
+        face_names = [name for _, name in self.identify_faces(face_locations, face_encodings)]
+
+        return face_locations, face_encodings, face_names, track_ids, encoded_at
+
+    @identify_faces_seconds.timed
     def identify_faces(self, face_locations, face_encodings):
         """ Identify known faces from face encodings """
-        face_names = []
-        for face_encoding in face_encodings:
-            # See if the face is a match for the known face(s)
-            matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding)
-            name = unknown_face_name
-
-            # Use the known face with the smallest distance to the new face
-            face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-            best_match_index = np.argmin(face_distances)
-            if matches[best_match_index]:
-                name = self.known_face_names[best_match_index] 
-            
-            face_names.append(name)
-        
+        # Score all faces against the whole gallery at once and use the known face with the smallest distance
+        # Faces without an encoding stay unknown
+        encoded = [i for i, encoding in enumerate(face_encodings) if encoding is not None]
+        face_names = [unknown_face_name] * len(face_encodings)
+        for i, (name, _) in zip(encoded, self.gallery.match([face_encodings[i] for i in encoded])):
+            if name is not None:
+                face_names[i] = name
+
         return zip(face_locations, face_names)
 
+    @approach_target_seconds.timed
     def approach_target(self, video_frame, top, right, bottom, left):
         """ The main navigation algorithm """
         x = left
@@ -319,10 +658,12 @@ class DroneControl(object):
         return target_reached and close_enough
 
     def take_off(self):
-        self.tello.takeoff()
+        """ Queue the take off, returns a Future instead of waiting for the drone """
+        return self.tello.send_control_command_async("takeoff")
     
     def land(self):
-        self.tello.land()
+        """ Queue the landing ahead of everything else, returns a Future instead of waiting for the drone """
+        return self.tello.send_control_command_async("land")
 
     def set_autonomous(self, autonomous): self.autonomous = autonomous
     def set_enroll_mode(self, enroll_mode): self.enroll_mode = enroll_mode
@@ -338,6 +679,18 @@ class DroneControl(object):
         
         return video_frame
 
+def create_models(threads=1):
+    """Face detector and embedder, and the RecognitionService that runs them (None if they run in this process).
+    threads is the number of threads that call them, each holds one frame of the service at a time
+    """
+    if recognition_processes:
+        service = RecognitionService(recognition_processes, dimensions, threads, face_detector, face_detector_options,
+                                     face_embedder, face_embedder_options).start()
+        return service.detector, service.embedder, service
+
+    return create_detector(face_detector, **face_detector_options), \
+        get_embedder(face_embedder, **face_embedder_options), None
+
 def lerp(a,b,c):
     return a + c*(b-a)
 
@@ -440,20 +793,21 @@ app.config.from_object(__name__)
 CORS(app, resources={r'/*': {'origins': '*'}})
 
 drone = None
+broadcaster = None
 
 @app.route('/') 
 def index(): 
    """Video streaming .""" 
    return render_template('./index.html') 
 
-def video_gen(): 
-    """Video streaming generator function.""" 
-    while True: 
-        drone.loop()
-        if drone.frame_available is not None:
-            _, image = cv2.imencode(".jpg", drone.get_video_frame())
-            yield (b'--frame\r\n' 
-                b'Content-Type: image/jpeg\r\n\r\n' + image.tobytes() + b'\r\n') 
+def video_gen(profile=None, max_fps=None, source=None): 
+    """Video streaming generator function. The frames are produced once by the broadcaster (or source) and encoded
+    once per profile
+    """
+    for chunk in (source or broadcaster).stream(profile, max_fps):
+        stream_frames.inc()
+        stream_bytes.inc(len(chunk))
+        yield chunk
 
 @app.route('/static/<path:path>')
 def send_static(path):
@@ -465,8 +819,19 @@ def send_faces(path):
 
 @app.route('/video_feed') 
 def video_feed(): 
-   """Video streaming route. Put this in the src attribute of an img tag.""" 
-   return Response(video_gen(), mimetype='multipart/x-mixed-replace; boundary=frame') 
+   """Video streaming route. Put this in the src attribute of an img tag.
+   Optional query parameters: fps (maximum frames per second), width, height and quality (JPEG quality 1-100),
+   e.g. /video_feed?width=320&fps=5&quality=60""" 
+   profile = broadcaster.profile(request.args.get('width', type=int),
+                                 request.args.get('height', type=int),
+                                 request.args.get('quality', type=int))
+   return Response(video_gen(profile, request.args.get('fps', type=float)),
+                   mimetype='multipart/x-mixed-replace; boundary=frame') 
+
+@app.route('/metrics')
+def metrics():
+    """Metrics in the Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/known_faces')
 def known_faces():
@@ -474,6 +839,10 @@ def known_faces():
 
 @app.route('/drone_status')
 def drone_status():
+    return jsonify(status_of(drone))
+
+def status_of(drone):
+    """ Velocities, battery and flight state of a drone, for /drone_status """
     try:
         battery = drone.get_battery()
         if battery == False:
@@ -482,29 +851,38 @@ def drone_status():
         battery = 0
     
     try:
-        flying = drone.tello.get_height()
-        if flying:
-            flying = int(flying.split('d')[0]) > 0
-        else:
-            flying = False
+        height = drone.tello.get_height()
+        flying = height is not False and height > 0
     except AttributeError as e:
         flying = False
 
+    # Both come from the state stream, its age shows how fresh they are
+    try:
+        state_age = drone.tello.get_state_age()
+    except AttributeError as e:
+        state_age = None
+
     status = {
         'for_back_velocity': drone.for_back_velocity,
         'up_down_velocity': drone.up_down_velocity,
         'left_right_velocity': drone.left_right_velocity,
         'yaw_velocity': drone.yaw_velocity,
         'battery': battery,
-        'flying': flying
+        'flying': flying,
+        'state_age': state_age,
+        'encoder_calls': drone.encoder_calls,
+        'encoder_calls_saved': drone.encoder_calls_saved
     }
 
-    return jsonify(status)
+    return status
 
 @app.route('/drone_command', methods=['POST'])
 def drone_command():
-    data = request.json
-    
+    apply_command(drone, request.json)
+    return redirect(url_for('drone_status'))
+
+def apply_command(drone, data):
+    """ Take off, land, velocities and modes of a drone from a /drone_command request """
     if 'command' in data:
         command = data['command']
         print(command)
@@ -528,9 +906,10 @@ def drone_command():
     if 'target_name' in data:
         drone.set_target_name(data['target_name'])
 
-    return redirect(url_for('drone_status'))
-
 if __name__ == '__main__': 
     drone = DroneControl()
+
+    # Runs the drone loop, independent of how many viewers there are
+    broadcaster = FrameBroadcaster(drone, frame_size=dimensions).start()
     app.run(host='0.0.0.0', debug=False, threaded=True)
 
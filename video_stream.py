@@ -0,0 +1,165 @@
+import threading
+import time
+import cv2
+from collections import namedtuple
+from threading import Thread
+
+# What a viewer gets: output resolution and JPEG quality
+StreamProfile = namedtuple('StreamProfile', ['width', 'height', 'quality'])
+
+DEFAULT_JPEG_QUALITY = 95
+MIN_STREAM_SIZE = 16
+
+
+class ProfileEncoder(object):
+    """The newest JPEG of one stream profile, shared by all viewers that use it"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.sequence = 0
+        self.jpeg = None
+        self.viewers = 0
+        self.lock = threading.Lock()
+
+    def encode(self, sequence, frame):
+        """ JPEG of the frame with this sequence number or a newer one, encoded at most once per frame """
+        with self.lock:
+            if self.sequence < sequence:
+                height, width = frame.shape[:2]
+                if (width, height) != (self.profile.width, self.profile.height):
+                    frame = cv2.resize(frame, (self.profile.width, self.profile.height), interpolation=cv2.INTER_AREA)
+
+                _, image = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.profile.quality])
+                self.jpeg = image.tobytes()
+                self.sequence = sequence
+            return self.jpeg
+
+
+class FrameBroadcaster:
+    """
+    This class runs the drone pipeline on a single producer thread and shares every annotated frame with any number
+    of viewers. The pipeline waits for each new camera frame, fps optionally caps its rate further. Each viewer reads
+    the newest frame through its own stream() generator, at its own maximum frame rate and stream profile. A profile
+    is encoded at most once per frame no matter how many viewers use it, and a slow viewer skips the frames it
+    missed, so neither the control loop nor the other viewers wait for it.
+    """
+
+    def __init__(self, drone, fps=None, frame_size=(960, 720)):
+        self.drone = drone
+        self.fps = fps
+        self.frame_size = frame_size
+
+        self.sequence = 0
+        self.frame = None
+        self.viewers = 0
+        self.stopped = False
+
+        self._encoders = {}
+        self._condition = threading.Condition()
+
+    def start(self):
+        thread = Thread(target=self.run, args=())
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def run(self):
+        interval = 1.0 / self.fps if self.fps else 0.0
+        while not self.stopped:
+            start = time.time()
+            try:
+                self.drone.loop()
+            except Exception as e:
+                print("Drone loop failed: {}".format(e))
+
+            # loop() returns without a new frame when the stream stalls
+            frame = self.drone.frame_available
+            if frame is not None and frame is not self.frame:
+                self.publish(frame)
+
+            elapsed = time.time() - start
+            if elapsed < interval:
+                time.sleep(interval - elapsed)
+
+    def publish(self, frame):
+        """ Share a frame with all viewers. The frame must not be modified afterwards """
+        with self._condition:
+            self.frame = frame
+            self.sequence += 1
+            self._condition.notify_all()
+
+    def wait_for_frame(self, last_sequence, timeout=1.0):
+        """Wait until there is a frame newer than last_sequence
+        Returns:
+            (int, ndarray): sequence and the newest frame, last_sequence again on timeout
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.sequence != last_sequence or self.stopped, timeout)
+            return self.sequence, self.frame
+
+    def profile(self, width=None, height=None, quality=None):
+        """Stream profile for the requested size and quality. A missing side keeps the aspect ratio, frames are
+        only ever scaled down.
+        """
+        frame_width, frame_height = self.frame_size
+        if width and not height:
+            height = int(round(width * frame_height / float(frame_width)))
+        elif height and not width:
+            width = int(round(height * frame_width / float(frame_height)))
+        elif not width and not height:
+            width, height = frame_width, frame_height
+
+        width = min(max(int(width), MIN_STREAM_SIZE), frame_width)
+        height = min(max(int(height), MIN_STREAM_SIZE), frame_height)
+        quality = DEFAULT_JPEG_QUALITY if quality is None else min(max(int(quality), 1), 100)
+
+        return StreamProfile(width, height, quality)
+
+    @property
+    def profiles(self):
+        """ Profiles currently watched and their number of viewers """
+        with self._condition:
+            return dict((profile, encoder.viewers) for profile, encoder in self._encoders.items())
+
+    def stream(self, profile=None, max_fps=None):
+        """ multipart/x-mixed-replace generator for one viewer """
+        if profile is None:
+            profile = self.profile()
+        interval = 1.0 / max_fps if max_fps else 0.0
+
+        with self._condition:
+            self.viewers += 1
+            encoder = self._encoders.get(profile)
+            if encoder is None:
+                encoder = self._encoders[profile] = ProfileEncoder(profile)
+            encoder.viewers += 1
+
+        try:
+            sequence = 0
+            next_time = 0.0
+            while not self.stopped:
+                # Keep to the viewer's frame rate, then take whatever frame is newest
+                delay = next_time - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+                new_sequence, frame = self.wait_for_frame(sequence)
+                if new_sequence == sequence:
+                    continue
+                sequence = new_sequence
+                next_time = max(next_time + interval, time.time())
+
+                jpeg = encoder.encode(sequence, frame)
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            with self._condition:
+                self.viewers -= 1
+                encoder.viewers -= 1
+                if encoder.viewers == 0:
+                    del self._encoders[profile]
+
+    def stop(self):
+        with self._condition:
+            self.stopped = True
+            self._condition.notify_all()